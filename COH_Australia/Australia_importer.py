@@ -11,7 +11,13 @@ Based on WFD importer.
 from __future__ import unicode_literals
 from builtins import dict, open
 import csv
+import itertools
+import math
+import multiprocessing
 import os.path as path
+import sys
+import time
+from array import array
 
 import pywikibot
 
@@ -20,14 +26,31 @@ import wikidataStuff.wdqsLookup as wdqs
 from wikidataStuff.WikidataStuff import WikidataStuff as WdS
 from wikidataStuff.PreviewItem import PreviewItem
 
+try:
+    from batchtools import (
+        BatchEdit, IdentifierIndex, edit_item, load_query_results)
+except ImportError:  # run from within its project directory
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    from batchtools import (
+        BatchEdit, IdentifierIndex, edit_item, load_query_results)
+
 parameter_help = """\
 ImporterBot options (may be omitted unless otherwise mentioned):
 -in_file           path to the main data file (if not data.csv)
 -new               if present new items are created on Wikidata, otherwise
-                   only updates are processed.
+                   only updates are processed. Each new item is created with
+                   all of its claims in a single edit.
 -cutoff            number items to process before stopping (if not then all)
 -preview_file      path to a file where previews should be outputted, sets the
                    run to demo mode
+-processes:INT     number of processes making previews in demo mode (default:
+                   the number of CPUs)
+-cache_max_age:INT max age (in seconds) of the locally stored identifier
+                   index and query results (default 0)
+-refresh           rerun all queries even if the stored results are younger
+                   than -cache_max_age
+-batch_edits       submit all new claims, references, labels and descriptions
+                   for an item in a single edit
 
 Can also handle any pywikibot options. Most importantly:
 -simulate          don't write to database
@@ -39,14 +62,59 @@ DATA_INPUT_FILE = 'data.csv'
 NATIONAL_COORD_FILE = 'national_coords.csv'
 COMMONWEALTH_COORD_FILE = 'commonwealth_coords.csv'
 LOGFILE = 'importer.log'
+QUERY_CACHE_FILE = 'queries.json'
+CREATION_INTERVAL = 1.0  # min number of seconds between item creations
 EDIT_SUMMARY = 'importing Australia #COH #WLM #au'
 DEFAULT_PREC = 0.0001  # default precision for coordinates
+PREVIEW_CHUNKSIZE = 50  # number of objects handed to a preview process at once
+_preview_bot = None  # the ImporterBot of a preview process
+
+
+class ItemCreator(object):
+    """
+    Creator of new items, each in a single call at a limited rate.
+
+    Creations refused because of replication lag (maxlag) are already
+    waited out and retried by pywikibot, so these are not retried here.
+    """
+
+    def __init__(self, wd, summary=None, interval=CREATION_INTERVAL):
+        """
+        Initialise the creator.
+
+        :param wd: the WikidataStuff instance used for creating items
+        :param summary: the edit summary to use
+        :param interval: min number of seconds between two creations
+        """
+        self.wd = wd
+        self.summary = summary
+        self.interval = interval
+        self.last_creation = None
+
+    def create(self, item_data):
+        """
+        Create a single item, waiting for its turn.
+
+        :param item_data: the full entity json of the new item
+        :return: pywikibot.ItemPage
+        """
+        if self.last_creation is not None:
+            delay = self.last_creation + self.interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_creation = time.time()
+        try:
+            return self.wd.make_new_item(item_data, self.summary)
+        except pywikibot.data.api.APIError as e:
+            raise pywikibot.Error('Error during item creation: {}'.format(e))
 
 
 class ImporterBot(object):
     """Bot to enrich/create info on Wikidata for Australian heritage items."""
 
-    def __init__(self, base_path, new=False, cutoff=None, preview_file=None):
+    def __init__(self, base_path, new=False, cutoff=None, preview_file=None,
+                 batch_edits=False, cache_max_age=0, processes=None,
+                 refresh=False):
         """
         Initialise the ImporterBot.
 
@@ -56,9 +124,18 @@ class ImporterBot(object):
             being interpreted as all.
         :param preview_file: run in demo mode (create previews rather than
             live edits) and output the result to this file.
+        :param batch_edits: whether to make all changes to an item in a
+            single edit
+        :param cache_max_age: max age (in seconds) of the locally stored
+            identifier index and query results
+        :param processes: the number of processes making previews in demo
+            mode. None being interpreted as the number of CPUs.
+        :param refresh: whether to rerun all queries regardless of the age
+            of the stored results
         """
         self.repo = pywikibot.Site().data_repository()
         self.wd = WdS(self.repo, EDIT_SUMMARY)
+        self.base_path = base_path
         self.new = new
         self.cutoff = cutoff
         if preview_file:
@@ -66,18 +143,25 @@ class ImporterBot(object):
             self.preview_file = path.join(base_path, preview_file)
         else:
             self.demo = False
-        self.preview_data = []
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_edits = batch_edits
+        self.batch = None  # BatchEdit for the current item
+        self.cache_max_age = 0 if refresh else cache_max_age
+        self.creator = ItemCreator(self.wd, EDIT_SUMMARY)
 
         self.set_references()
         self.place_id_p = 'P3008'  # unique identifier property
         self.country = self.wd.QtoItemPage('Q408')
         self.states = self.make_states_map()
         self.settlements = self.make_settlements_map()
+        self.make_location_indexes()
         self.hectares = self.wd.QtoItemPage(helpers.get_unit_q('ha'))
         self.make_status_and_instance_map()
 
-        self.place_id_items = helpers.fill_cache_wdqs(
-            self.place_id_p, no_strip=True)
+        self.place_id_items = IdentifierIndex(
+            self.place_id_p,
+            lambda: helpers.fill_cache_wdqs(self.place_id_p, no_strip=True),
+            self.cache_max_age)
 
     def set_references(self):
         """Set the three types of references needed."""
@@ -130,7 +214,8 @@ class ImporterBot(object):
             'SERVICE wikibase:label { bd:serviceParam wikibase:language "en" . }'  # noqa
             "}"
         )
-        data = wdqs.make_simple_wdqs_query(sparql)
+        data = self.load_query_results(
+            sparql, lambda: wdqs.make_simple_wdqs_query(sparql))
         settlements = dict()
         for d in data:
             state_qid = d['admin'].split('/')[-1]
@@ -159,7 +244,8 @@ class ImporterBot(object):
             "BIND(REPLACE(?value, 'AU-', '', 'i') AS ?iso) "
             "}"
         )
-        data = wdqs.make_select_wdqs_query(sparql, 'item', 'iso')
+        data = self.load_query_results(
+            sparql, lambda: wdqs.make_select_wdqs_query(sparql, 'item', 'iso'))
         states = dict()
         for k, v in data.items():
             states[v] = self.wd.QtoItemPage(k)
@@ -184,6 +270,54 @@ class ImporterBot(object):
 
         return states
 
+    def make_location_indexes(self):
+        """
+        Index the state and settlement maps for quick lookups.
+
+        Only settlement names which are unique within a state/territory
+        are kept, as a single hit is needed. The names of the EXT and
+        OS maps are indexed as address suffixes, with the lengths of these
+        kept so that each address only needs a lookup per suffix length.
+        """
+        self.place_index = dict()  # (name, state qid) to settlement qid
+        ambiguous = set()
+        for name, candidates in self.settlements.items():
+            for candidate in candidates:
+                key = (name, candidate['state'])
+                if self.place_index.get(key, candidate['qid']) != \
+                        candidate['qid']:
+                    ambiguous.add(key)
+                self.place_index[key] = candidate['qid']
+        for key in ambiguous:
+            del self.place_index[key]
+
+        self.suffix_index = dict()  # state code to address suffix to item
+        self.suffix_lengths = dict()  # state code to suffix lengths
+        for state in ('EXT', 'OS'):
+            suffixes = dict()
+            for key, v in self.states[state].items():
+                for suffix in key.split('|'):
+                    suffixes.setdefault(suffix, v)
+            self.suffix_index[state] = suffixes
+            self.suffix_lengths[state] = sorted(
+                set(len(suffix) for suffix in suffixes), reverse=True)
+
+    def load_query_results(self, sparql, query):
+        """
+        Return the results of a query, reusing any stored results.
+
+        Results are stored in the output directory and reused for as long
+        as they are younger than self.cache_max_age.
+
+        :param sparql: the query, used as key for the stored results
+        :param query: function running the query and returning json
+            serialisable results
+        :return: the query results
+        """
+        return load_query_results(
+            path.join(self.base_path, QUERY_CACHE_FILE), sparql, query,
+            self.cache_max_age)
+
     def make_url_ref(self, url, fetch_date, publish_date=None):
         """Make a Reference object for a url.
 
@@ -216,34 +350,115 @@ class ImporterBot(object):
         )
         return ref
 
-    def output_previews(self):
-        """Output any PreviewItems to the preview_file."""
-        with open(self.preview_file, 'w', encoding='utf-8') as f:
-            for preview in self.preview_data:
-                f.write(preview.make_preview_page())
-                f.write('--------------\n\n')
+    def output_previews(self, objects):
+        """
+        Output a preview of each object to the preview_file.
+
+        The previews are made in a pool of processes, if more than one, and
+        are written as soon as they are ready, in the order of the objects.
+
+        :param objects: (data, qid) pairs, as yielded by select_objects()
+        """
+        pool = None
+        if self.processes > 1:
+            pool = multiprocessing.Pool(
+                self.processes, init_preview_process, (self.base_path, ))
+            previews = self.make_previews_in_pool(pool, objects)
+        else:
+            previews = (self.make_preview_page(data, qid)
+                        for data, qid in objects)
+
+        try:
+            with open(self.preview_file, 'w', encoding='utf-8') as f:
+                for preview in previews:
+                    f.write(preview)
+                    f.write('--------------\n\n')
+        finally:
+            if pool:
+                pool.terminate()
         pywikibot.output('Created "{}" for previews'.format(self.preview_file))
 
-    def process_all_objects(self, data):
+    def make_previews_in_pool(self, pool, objects):
         """
-        Handle all the Australian heritage objects.
+        Make previews in a pool of processes, a limited number at a time.
+
+        The objects are taken in windows here, in the main thread, rather
+        than handing the generator to Pool.imap() which would consume it
+        from its task handler thread. select_objects() looks up each qid
+        in the identifier index and so has to run in the thread owning
+        it. This also stops imap() from queueing all of the objects at once.
+
+        :param pool: the multiprocessing.Pool to use
+        :param objects: (data, qid) pairs, as yielded by select_objects()
+        :return: generator of str
+        """
+        objects = iter(objects)
+        window_size = self.processes * PREVIEW_CHUNKSIZE * 2
+        while True:
+            window = list(itertools.islice(objects, window_size))
+            if not window:
+                return
+            for preview in pool.imap(
+                    make_preview_page, window, PREVIEW_CHUNKSIZE):
+                yield preview
+
+    def select_objects(self, data):
+        """
+        Yield the Australian heritage objects to handle.
 
-        Only increments counter when an object is updated.
+        Only increments counter when an object is to be updated.
 
-        :param data: dict of all the heritage objects.
+        :param data: iterable of the heritage objects, each a dict
+        :return: generator of (dict, str|None) with the data for an object
+            and the qid of its item, or None if one should be created.
         """
         count = 0
-        for place_id, entry_data in data.items():
+        for entry_data in data:
             if self.cutoff and count >= self.cutoff:
                 break
-            item = None
-            if place_id in self.place_id_items:
-                item = self.wd.QtoItemPage(self.place_id_items[place_id])
-
-            if item or self.new:
-                self.process_single_object(entry_data, item)
+            qid = self.place_id_items.get(entry_data.get('place_id'))
+            if qid or self.new:
+                yield entry_data, qid
                 count += 1
 
+    def process_all_objects(self, data):
+        """
+        Handle all the Australian heritage objects.
+
+        In demo mode previews are made instead of live edits.
+
+        :param data: iterable of the heritage objects, each a dict. Only
+            consumed as far as needed.
+        """
+        objects = self.select_objects(data)
+        if self.demo:
+            self.output_previews(objects)
+            return
+
+        for entry_data, qid in objects:
+            item = self.wd.QtoItemPage(qid) if qid else None
+            self.process_single_object(entry_data, item)
+
+    def make_preview_page(self, data, qid):
+        """
+        Make the preview of a single Australian heritage object.
+
+        Only local data is used so this is safe to run in a separate
+        process.
+
+        :param data: dict of data for a single object
+        :param qid: the qid of the item associated with an object, or None
+            if one would be created.
+        :return: str
+        """
+        item = self.wd.QtoItemPage(qid) if qid else None
+        labels = self.make_labels(data)
+        descriptions = self.make_descriptions(data)
+        protoclaims = self.make_protoclaims(data)
+        ref = self.ref[self.get_heritage_type(data['type'])]
+        preview = PreviewItem(labels, descriptions, protoclaims, item, ref)
+        return preview.make_preview_page()
+
     def process_single_object(self, data, item):
         """
         Process a single Australian heritage object.
@@ -252,9 +467,10 @@ class ImporterBot(object):
         :param item: Wikidata item associated with an object, or None if one
             should be created.
         """
-        if not self.demo:
-            item = item or self.create_new_place_id_item(data)
-            item.exists()  # load the item contents
+        if not item:
+            self.create_new_place_id_item(data)
+            return
+        item.exists()  # load the item contents
 
         # Determine claims
         labels = self.make_labels(data)
@@ -263,21 +479,32 @@ class ImporterBot(object):
         ref = self.ref[self.get_heritage_type(data['type'])]
 
         # Upload claims
-        if self.demo:
-            self.preview_data.append(
-                PreviewItem(labels, descriptions, protoclaims,
-                            item, ref))
-        else:
-            self.commit_labels(labels, item)
-            self.commit_descriptions(descriptions, item)
-            self.commit_claims(protoclaims, item, ref)
+        if self.batch_edits:
+            self.batch = BatchEdit(self.wd, item, EDIT_SUMMARY)
+        self.commit_labels(labels, item)
+        self.commit_descriptions(descriptions, item)
+        self.commit_claims(protoclaims, item, ref)
+        if self.batch:
+            self.batch.submit()
+            self.batch = None
 
     def create_new_place_id_item(self, data):
         """
-        Create a new place_id item with some basic info and return it.
+        Create a new place_id item with all of its info.
+
+        The item is created, with all of its claims, in a single call.
 
         :param data: dict of data for a single object
-        :return: pywikibot.ItemPage
+        """
+        item = self.creator.create(self.make_new_item_data(data))
+        self.place_id_items[data.get('place_id')] = item.getID()
+
+    def make_new_item_data(self, data):
+        """
+        Make the full entity json for a new place_id item.
+
+        :param data: dict of data for a single object
+        :return: dict
         """
         labels = helpers.convert_language_dict_to_json(
             self.make_labels(data),
@@ -285,19 +512,24 @@ class ImporterBot(object):
         desc = helpers.convert_language_dict_to_json(
             self.make_descriptions(data),
             typ='descriptions')
-        id_claim = self.wd.make_simple_claim(
-            self.place_id_p, data.get('place_id'))
+        default_ref = self.ref[self.get_heritage_type(data['type'])]
+
+        # the claim building of BatchEdit does not depend on an item
+        builder = BatchEdit(self.wd, None)
+        claims = []
+        for prop, statement, ref in self.iter_statements(
+                self.make_protoclaims(data), default_ref):
+            claim = builder.make_claim(prop, statement)
+            if ref:
+                claim.sources.append(builder.make_source(ref))
+            claims.append(claim.toJSON())
 
         item_data = {
             "labels": labels,
             "descriptions": desc,
-            "claims": [id_claim.toJSON(), ]
+            "claims": claims
         }
-
-        try:
-            return self.wd.make_new_item(item_data, EDIT_SUMMARY)
-        except pywikibot.data.api.APIError as e:
-            raise pywikibot.Error('Error during item creation: {:s}'.format(e))
+        return item_data
 
     def make_labels(self, data):
         """
@@ -339,7 +571,11 @@ class ImporterBot(object):
         :param labels: label object
         :param item: item to add labels to
         """
-        if labels:
+        if labels and self.batch:
+            for lang, names in labels.items():
+                for name in names:
+                    self.batch.add_label_or_alias(lang, name)
+        elif labels:
             self.wd.add_multiple_label_or_alias(
                 labels, item, case_sensitive=False)
 
@@ -350,7 +586,10 @@ class ImporterBot(object):
         :param descriptions: description object
         :param item: item to add descriptions to
         """
-        if descriptions:
+        if descriptions and self.batch:
+            for lang, description in descriptions.items():
+                self.batch.add_description(lang, description)
+        elif descriptions:
             self.wd.add_multiple_descriptions(descriptions, item)
 
     def commit_claims(self, protoclaims, item, default_ref):
@@ -363,6 +602,20 @@ class ImporterBot(object):
         :param item: the target entity
         :param default_ref: main/default reference to use
         """
+        for prop, statement, ref in self.iter_statements(
+                protoclaims, default_ref):
+            self.add_claim(prop, statement, item, ref)
+
+    def iter_statements(self, protoclaims, default_ref):
+        """
+        Yield each actual statement of the protoclaims with its reference.
+
+        :param protoclaims: a dict of claims with
+            key: Prop number
+            val: Statement|list of Statements
+        :param default_ref: main/default reference to use
+        :return: generator of (prop, Statement, Reference)
+        """
         for prop, statements in protoclaims.items():
             if statements:
                 statements = helpers.listify(statements)
@@ -372,12 +625,23 @@ class ImporterBot(object):
                     if (statement is not None) and (not statement.isNone()):
                         # use internal reference if present, else the general
                         ref = statement.ref or default_ref
-                        self.wd.addNewClaim(
-                            prop, statement, item, ref)
+                        yield prop, statement, ref
+
+    def add_claim(self, prop, statement, item, ref):
+        """
+        Add a claim (if new) and source it, without reloading the item.
+
+        :param prop: the property of the claim
+        :param statement: the Statement to add
+        :param item: the target entity
+        :param ref: the Reference to add
+        """
+        if self.batch:
+            self.batch.add_claim(prop, statement, ref)
+            return
 
-                        # reload item so that next call is aware of changes
-                        item = self.wd.QtoItemPage(item.title())
-                        item.exists()
+        edit_item(
+            item, lambda i: self.wd.addNewClaim(prop, statement, i, ref))
 
     def make_protoclaims(self, data):
         """
@@ -467,53 +731,147 @@ class ImporterBot(object):
         """
         place = address.rpartition(',')[2][:-len(state)].strip()
         state_item = self.get_state(state, address)
-        if place in self.settlements and state_item:
-            hits = []
-            for candidate in self.settlements[place]:
-                if candidate['state'] == state_item.id:
-                    hits.append(candidate['qid'])
-            if len(set(hits)) == 1:
-                return self.wd.QtoItemPage(hits[0])
+        if state_item:
+            qid = self.place_index.get((place, state_item.id))
+            if qid:
+                return self.wd.QtoItemPage(qid)
 
     def get_state(self, state, address):
         """Determine which state/territory the object is in."""
         state_item = None
         if state not in self.states:
             pywikibot.error('Unrecognized state: {0}'.format(state))
-        elif state == 'EXT':
-            address = address[:-len('EXT')].strip()
-            for key, v in self.states['EXT'].items():
-                if any(address.endswith(k) for k in key.split('|')):
-                    state_item = v
-                    break
-        elif state == 'OS':
-            for k, v in self.states['OS'].items():
-                if address.endswith(k):
-                    state_item = v
+        elif state in self.suffix_index:
+            if state == 'EXT':
+                address = address[:-len('EXT')].strip()
+            suffixes = self.suffix_index[state]
+            for length in self.suffix_lengths[state]:
+                state_item = suffixes.get(address[-length:])
+                if state_item:
                     break
         else:
             state_item = self.states[state]
         return state_item
 
 
-def load_csv_data(filename, log):
-    """Load the csv files and handle any duplicate entries."""
+def init_preview_process(base_path):
+    """
+    Set up the bot of a preview process.
+
+    Previews only need local data, so the bot reuses the query results
+    stored by the main process, whatever their age.
+
+    :param base_path: path to the output directory
+    """
+    global _preview_bot
+    _preview_bot = ImporterBot(base_path, cache_max_age=float('inf'))
+
+
+def make_preview_page(obj):
+    """
+    Make the preview of an object using the bot of the preview process.
+
+    :param obj: tuple (data, qid) as yielded by ImporterBot.select_objects()
+    :return: str
+    """
+    return _preview_bot.make_preview_page(*obj)
+
+
+class CoordinateIndex(object):
+    """Compact index of the coordinates in a coordinate file."""
+
+    def __init__(self, rows):
+        """
+        Index the coordinates of each place_id.
+
+        Missing or dropped (conflicting) coordinates are kept as NaN.
+
+        :param rows: the rows of a coordinate file, each a dict
+        """
+        self.positions = dict()  # place_id to position in lat/lon arrays
+        self.lat = array('d')
+        self.lon = array('d')
+        for row in rows:
+            self.positions[row.get('place_id')] = len(self.lat)
+            self.lat.append(parse_coordinate(row.get('lat')))
+            self.lon.append(parse_coordinate(row.get('lon')))
+
+    def __contains__(self, place_id):
+        """Check if a place_id is present in the coordinate file."""
+        return place_id in self.positions
+
+    def get(self, place_id):
+        """
+        Get the coordinates of a place_id.
+
+        :param place_id: the place_id to look up
+        :return: (float|None, float|None) the latitude and longitude, or
+            None if the place_id is not in the coordinate file.
+        """
+        if place_id not in self.positions:
+            return None
+        i = self.positions[place_id]
+        return tuple(None if math.isnan(v) else v
+                     for v in (self.lat[i], self.lon[i]))
+
+
+def parse_coordinate(value):
+    """Convert a coordinate to a float, with NaN for a missing value."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def read_csv_rows(filename):
+    """Yield each row of a csv file as a dict."""
     with open(filename, encoding='utf-8') as csv_file:
         reader = csv.DictReader(
             csv_file, delimiter='|', quoting=csv.QUOTE_NONE)
-        local_log = []
-
-        result = {}
         for row in reader:
-            key = row.get('place_id')
-            if key in result:
-                result[key] = handle_dupe(row, result[key], local_log, key)
-            else:
-                result[key] = row
+            yield row
 
-        if local_log:
-            log[filename] = local_log
-        return result
+
+def load_csv_data(filename, log):
+    """
+    Stream the rows of a csv file and handle any duplicate entries.
+
+    The file is read twice. The first pass only notes which place_ids are
+    repeated. In the second pass other rows are yielded directly while
+    duplicates are held back until their last occurrence and then yielded
+    once, with any conflicting fields dropped.
+
+    :param filename: the csv file to load
+    :param log: dict to which any log messages are added, under filename
+    :return: generator of dict
+    """
+    seen = set()
+    occurrences = dict()  # place_id to number of rows, for repeated ones
+    for row in read_csv_rows(filename):
+        key = row.get('place_id')
+        if key in seen:
+            occurrences[key] = occurrences.get(key, 1) + 1
+        else:
+            seen.add(key)
+    seen = None
+
+    local_log = []
+    dupes = dict()  # place_id to the merged rows so far
+    for row in read_csv_rows(filename):
+        key = row.get('place_id')
+        if key not in occurrences:
+            yield row
+            continue
+
+        if key in dupes:
+            log[filename] = local_log  # logged even if not fully consumed
+            row = handle_dupe(row, dupes[key], local_log, key)
+        occurrences[key] -= 1
+        if occurrences[key]:
+            dupes[key] = row
+        else:
+            dupes.pop(key, None)
+            yield row
 
 
 def handle_dupe(new_entry, old_entry, log, place_id):
@@ -530,31 +888,37 @@ def handle_dupe(new_entry, old_entry, log, place_id):
 
 
 def combine_data(main_data, nat_coords_data, com_coords_data, log):
-    """Add the coordinates to the main data store."""
+    """
+    Add the coordinates to each entry of the main data.
+
+    :param main_data: iterable of the heritage objects, each a dict
+    :param nat_coords_data: CoordinateIndex of the national coordinates
+    :param com_coords_data: CoordinateIndex of the commonwealth coordinates
+    :param log: dict to which any log messages are added, under 'combining'
+    :return: generator of dict
+    """
     local_log = []
-    for k, v in main_data.items():
+    for entry in main_data:
+        k = entry.get('place_id')
         found_coord = None
         coords = {'lat': None, 'lon': None}
 
         if k in nat_coords_data:
-            found_coord = nat_coords_data[k]
+            found_coord = nat_coords_data.get(k)
         if k in com_coords_data:
             if found_coord:
+                log['combining'] = local_log
                 local_log.append(
                     'Found coordinates in both files for {0}. Skip'.format(k))
                 found_coord = None
             else:
-                found_coord = com_coords_data[k]
+                found_coord = com_coords_data.get(k)
 
-        if found_coord and found_coord['lat'] and found_coord['lon']:
-            coords['lat'] = found_coord['lat']
-            coords['lon'] = found_coord['lon']
+        if found_coord and found_coord[0] and found_coord[1]:
+            coords['lat'], coords['lon'] = found_coord
 
-        main_data[k].update(coords)
-
-    if local_log:
-        log['combining'] = local_log
-    return main_data
+        entry.update(coords)
+        yield entry
 
 
 def main(*args):
@@ -563,24 +927,22 @@ def main(*args):
     options = handle_args(args)
     log = {}
 
-    # load 3 indata files and combine
+    # index the 2 coordinate files and stream the combined main data file
     data_file = options.pop('in_file') or path.join(base_path, DATA_INPUT_FILE)
-    main_data = load_csv_data(data_file, log)
-    nat_coords_data = load_csv_data(
-        path.join(base_path, NATIONAL_COORD_FILE), log)
-    com_coords_data = load_csv_data(
-        path.join(base_path, COMMONWEALTH_COORD_FILE), log)
-    data = combine_data(main_data, nat_coords_data, com_coords_data, log)
-
-    if log:
-        output_log(path.join(base_path, LOGFILE), log)
+    nat_coords_data = CoordinateIndex(load_csv_data(
+        path.join(base_path, NATIONAL_COORD_FILE), log))
+    com_coords_data = CoordinateIndex(load_csv_data(
+        path.join(base_path, COMMONWEALTH_COORD_FILE), log))
+    data = combine_data(
+        load_csv_data(data_file, log), nat_coords_data, com_coords_data, log)
 
     # initialise ImporterBot
     bot = ImporterBot(base_path, **options)
-    bot.process_all_objects(data)
-
-    if bot.demo:
-        bot.output_previews()
+    try:
+        bot.process_all_objects(data)
+    finally:
+        if log:
+            output_log(path.join(base_path, LOGFILE), log)
 
 
 def output_log(logfile, log):
@@ -611,6 +973,10 @@ def handle_args(args):
         'cutoff': None,
         'preview_file': None,
         'in_file': None,
+        'batch_edits': False,
+        'cache_max_age': 0,
+        'processes': None,
+        'refresh': False,
     }
 
     for arg in pywikibot.handle_args(args):
@@ -623,6 +989,14 @@ def handle_args(args):
             options['cutoff'] = int(value)
         elif option == '-preview_file':
             options['preview_file'] = value
+        elif option == '-batch_edits':
+            options['batch_edits'] = True
+        elif option == '-cache_max_age':
+            options['cache_max_age'] = int(value)
+        elif option == '-processes':
+            options['processes'] = int(value)
+        elif option == '-refresh':
+            options['refresh'] = True
 
     return options
 
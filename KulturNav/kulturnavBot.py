@@ -15,10 +15,19 @@ usage:
 
 &params;
 """
+import collections
+import gzip
+import itertools
 import json
+import os
+import Queue
 import re
+import sys
+import tempfile
+import threading
 import time
 import urllib2
+from multiprocessing.pool import ThreadPool
 
 import pywikibot
 
@@ -26,6 +35,16 @@ import wikidataStuff.helpers as helpers
 import wikidataStuff.wdqsLookup as wdqsLookup
 from wikidataStuff.WikidataStuff import WikidataStuff as WD
 
+try:
+    from batchtools import (
+        BatchEdit, IdentifierIndex, RateLimiter, edit_item,
+        load_query_results, preload_items)
+except ImportError:  # run from within its project directory
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from batchtools import (
+        BatchEdit, IdentifierIndex, RateLimiter, edit_item,
+        load_query_results, preload_items)
+
 FOO_BAR = u'A multilingual result (or one with multiple options) was ' \
           u'encountered but I have yet to support that functionality'
 
@@ -36,9 +55,29 @@ Basic KulturnavBot options (may be omitted):
                     (default 250)
 -delay:INT         seconds to delay between each kulturnav request
                     (default 0)
+-workers:INT       number of kulturnav entries, or search result pages, to
+                    fetch concurrently (default 1)
+-rate:FLOAT        max number of kulturnav requests per second, shared by
+                    all workers (default no limit)
+-kulturnav_cache[:INT]  store kulturnav records locally and reuse them for
+                    up to this many seconds (default no caching). If no
+                    value is given the stored records never expire. A
+                    stored record is also reused, whatever its age, when
+                    the search reports it as unchanged.
+-incremental       skip entries which were not modified since the last
+                    completed run on the dataset. Entries are skipped
+                    before being fetched if the search reports when they
+                    were modified. Cannot be combined with a never expiring
+                    -kulturnav_cache.
+-pipeline:INT      fetch and resolve up to this many kulturnav entries in a
+                    separate thread, ahead of the Wikidata edits (default 0)
+-preload:INT       load the Wikidata entities needed by this many entries
+                    at a time, using batched requests (default 0)
+-batch_edits       submit all new claims, references and names for an item
+                    in a single edit
 -any_item          if present it does not filter kulturnav results on wikidata
--wdq_cache:INT     set the cache age (in seconds) for wdq queries
-                    (default 0)
+-wdq_cache:INT     set the cache age (in seconds) for wdq queries and the
+                    locally stored identifier index (default 0)
 
 Can also handle any pywikibot options. Most importantly:
 -simulate          don't write to database
@@ -102,7 +141,7 @@ class Rule(object):
         :return: bool
         """
         for n in needles:
-            if n not in haystack.keys():
+            if n not in haystack:
                 return False
         return True
 
@@ -120,16 +159,33 @@ class Rule(object):
         if helpers.is_str(via_id):
             via_id = (via_id, )
 
-        i = 0
-        while len(via_id) > i:
-            id_entry = via_id[i]
-            if value in ids.keys() and id_entry in ids[value].keys():
+        for id_entry in via_id:
+            # only strings can be @id values (and others may be unhashable)
+            if helpers.is_str(value) and value in ids and \
+                    id_entry in ids[value]:
                 value = ids[value][id_entry]
-                i += 1
             else:
                 return None
         return value
 
+    @staticmethod
+    def compile_rules(rules):
+        """
+        Index the rules on the key which must be present for them to match.
+
+        For a None rule this is the key itself and for a Rule its target.
+
+        :param rules: a dict with keys and values either None or a Rule
+        :return: dict of key -> list of (values key, rule) tuples
+        """
+        index = {}
+        for key, rule in rules.iteritems():
+            if rule is None:
+                index.setdefault(key, []).append((key, rule))
+            elif isinstance(rule, Rule):
+                index.setdefault(rule.target, []).append((key, rule))
+        return index
+
     def resolve(self, entries, ids):
         """
         Resolve a rule to return the resulting value.
@@ -181,6 +237,227 @@ class Rule(object):
         return value
 
 
+class KulturnavCache(object):
+    """
+    A local store of KulturNav JSON-LD records.
+
+    Each record is kept as a gzipped json file, named after its uuid,
+    together with the "modified" timestamp of the record and the time at
+    which it was retrieved.
+    """
+
+    def __init__(self, max_age=None, cache_dir=None):
+        """
+        Initialise the cache.
+
+        :param max_age: int|None number of seconds for which a stored record
+            is served. None means that stored records never expire.
+        :param cache_dir: directory in which to store the records. Defaults
+            to kulturnav_cache next to this file.
+        """
+        self.max_age = max_age
+        self.cache_dir = cache_dir or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'kulturnav_cache')
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_filename(self, uuid):
+        """Return the path to the stored record for a uuid."""
+        return os.path.join(self.cache_dir, '%s.json.gz' % uuid)
+
+    def get(self, uuid, modified=None):
+        """
+        Retrieve a stored record.
+
+        If the current "modified" timestamp of the record is known the
+        stored record is only served if it is as recent, whatever its age.
+
+        :param uuid: the uuid for the target item
+        :param modified: str|None the current "modified" timestamp of the
+            record, if known
+        :return: dict|None the entry object, if stored and not outdated
+        """
+        try:
+            with gzip.open(self.get_filename(uuid), 'rb') as f:
+                stored = json.loads(f.read())
+        except (IOError, ValueError):
+            return None
+
+        if helpers.is_str(modified) and helpers.is_str(stored[u'modified']):
+            if stored[u'modified'] < modified:
+                return None
+        elif self.max_age is not None and \
+                time.time() - stored[u'retrieved'] > self.max_age:
+            return None
+        return stored[u'data']
+
+    def put(self, uuid, json_data):
+        """
+        Store a record.
+
+        The record is first written to a temporary file so that concurrent
+        readers never encounter a partially written record.
+
+        :param uuid: the uuid for the target item
+        :param json_data: the entry object
+        """
+        stored = {
+            'uuid': uuid,
+            'modified': KulturnavCache.get_modified(json_data),
+            'retrieved': time.time(),
+            'data': json_data
+        }
+        handle, tmp_name = tempfile.mkstemp(dir=self.cache_dir)
+        os.close(handle)
+        with gzip.open(tmp_name, 'wb') as f:
+            f.write(json.dumps(stored))
+        os.rename(tmp_name, self.get_filename(uuid))
+
+    @staticmethod
+    def get_modified(json_data):
+        """
+        Return the "modified" timestamp of a record.
+
+        :param json_data: the entry object
+        :return: str|None
+        """
+        for entries in json_data[u'@graph']:
+            if entries.get(u'modified'):
+                return entries[u'modified']
+
+
+class KulturnavFetcher(object):
+    """
+    Iterable of KulturNav entries fetched from a list of uuids.
+
+    With more than one worker the entries are fetched concurrently by a
+    thread pool, at most lookahead requests ahead of the consumer, but they
+    are still yielded in the order of the uuids. Entries which could not be
+    loaded are skipped.
+    """
+
+    def __init__(self, uuids, workers=1, rate=None, delay=0, lookahead=None,
+                 cache=None, modified=None):
+        """
+        Initialise the fetcher.
+
+        :param uuids: list of uuids to request items for
+        :param workers: int number of concurrent requests
+        :param rate: float|None max number of requests per second
+        :param delay: int seconds to sleep before each request, only used
+            when there is a single worker
+        :param lookahead: int max number of requests running ahead of the
+            consumer. Defaults to twice the number of workers.
+        :param cache: KulturnavCache|None local store to serve records from
+            and to add any newly retrieved records to
+        :param modified: dict|None uuid to the current "modified" timestamp
+            of the record, as reported by the search, used to check that a
+            stored record is up to date
+        """
+        self.uuids = uuids
+        self.workers = max(1, workers)
+        self.delay = delay if self.workers == 1 else 0
+        self.lookahead = lookahead or 2 * self.workers
+        self.limiter = RateLimiter(rate)
+        self.cache = cache
+        self.modified = modified or {}
+        self.pending = collections.deque()
+
+    @property
+    def depth(self):
+        """Return the number of requests running ahead of the consumer."""
+        return len(self.pending)
+
+    def fetch(self, uuid):
+        """
+        Retrieve a single entry, respecting the delay and rate limit.
+
+        Entries present in the cache are served without any request.
+
+        :param uuid: the uuid for the target item
+        :return: dict|None the entry object or None if it could not be loaded
+        """
+        if self.cache:
+            json_data = self.cache.get(uuid, self.modified.get(uuid))
+            if json_data is not None:
+                return json_data
+
+        time.sleep(self.delay)
+        self.limiter.wait()
+        try:
+            json_data = KulturnavBot.get_single_entry(uuid)
+        except pywikibot.Error as e:
+            pywikibot.output(e)
+            return None
+
+        if self.cache:
+            self.cache.put(uuid, json_data)
+        return json_data
+
+    def __iter__(self):
+        """Yield the entries in the order of the uuids."""
+        if self.workers == 1:
+            for uuid in self.uuids:
+                json_data = self.fetch(uuid)
+                if json_data is not None:
+                    yield json_data
+            return
+
+        pool = ThreadPool(self.workers)
+        uuids = iter(self.uuids)
+        try:
+            for uuid in itertools.islice(uuids, self.lookahead):
+                self.pending.append(pool.apply_async(self.fetch, (uuid, )))
+            while self.pending:
+                json_data = self.pending.popleft().get()
+                for uuid in itertools.islice(uuids, 1):
+                    self.pending.append(
+                        pool.apply_async(self.fetch, (uuid, )))
+                if json_data is not None:
+                    yield json_data
+        finally:
+            self.pending.clear()
+            pool.terminate()
+
+
+class CachedWD(WD):
+    """A WikidataStuff instance serving item pages from a local cache."""
+
+    def __init__(self, repo, edit_summary=None):
+        """
+        Initialise the instance.
+
+        :param repo: the data repository
+        :param edit_summary: the edit summary to use
+        """
+        WD.__init__(self, repo, edit_summary)
+        self.entity_cache = {}  # Q-id to loaded pywikibot.ItemPage
+
+    def QtoItemPage(self, Q):
+        """
+        Make a pywikibot.ItemPage given a Q-value, reusing any cached page.
+
+        :param Q: the Q-id of the item, with or without the Q prefix
+        :return: pywikibot.ItemPage
+        """
+        qid = u'Q%s' % Q.lstrip('Q') if helpers.is_str(Q) else u'Q%d' % Q
+        if qid in self.entity_cache:
+            return self.entity_cache[qid]
+        return WD.QtoItemPage(self, Q)
+
+    def preload(self, qids):
+        """
+        Load the given items into the cache using batched requests.
+
+        Missing items and redirects are left out and are instead loaded
+        the usual way, if ever needed.
+
+        :param qids: Q-ids of the items to load
+        """
+        self.entity_cache.update(preload_items(
+            self.repo, set(qids) - set(self.entity_cache.keys())))
+
+
 class KulturnavBot(object):
     """Bot to enrich and create information on Wikidata from KulturNav info."""
 
@@ -198,10 +475,16 @@ class KulturnavBot(object):
     DATASET_ID = None
     ENTITY_TYPE = None
     MAP_TAG = None
-    COUNTRIES = []  # a list of country Q's
-    ADMIN_UNITS = []  # a list of municipality+county Q's
+    COUNTRIES = set()  # a set of country Q's
+    ADMIN_UNITS = set()  # a set of municipality+county Q's
     locations = {}  # a dict of uuid to wikidata location matches
     current_uuid = ''  # for debugging
+    STATE_FILE = 'kulturnav_state.json'  # high-water marks per dataset
+    QUERY_CACHE_FILE = 'kulturnav_queries.json'  # stored wdqs results
+    LOCATIONS_FILE = 'kulturnav_locations.json'  # stored location matches
+    LOCATION_KEYS = (  # value keys which may hold kulturnav places
+        u'birthPlace_P7', u'deathPlace_P7', u'person.nationality',
+        u'location', u'homePort', u'built.location', u'launched.location')
 
     def __init__(self, dictGenerator, cache_max_age, verbose=False):
         """
@@ -216,17 +499,31 @@ class KulturnavBot(object):
         self.verbose = verbose
         self.require_wikidata = True
         self.cache_max_age = cache_max_age
-
-        # trigger wdq query
-        self.itemIds = helpers.fill_cache(self.KULTURNAV_ID_P,
-                                          cache_max_age=cache_max_age)
+        self.since = None  # skip entries not modified after this
+        self.latest_modified = None  # latest modified timestamp encountered
+        self.completed = False  # if the last run handled all entries
+        self.pipeline_size = 0  # max number of entries resolved in advance
+        self.pipeline_queue = None
+        self.preload_size = 0  # number of entries to preload entities for
+        self.batch_edits = False  # if each item is changed in a single edit
+        self.batch = None  # BatchEdit for the current item
+        self.workers = 1  # number of concurrent kulturnav requests
+        self.rate = None  # max number of kulturnav requests per second
+        self.location_retrieved = {}  # uuid to time of location match
+
+        # load the kulturnav id index, triggering a wdq query if outdated
+        self.itemIds = IdentifierIndex(
+            u'P%s' % self.KULTURNAV_ID_P,
+            lambda: helpers.fill_cache(self.KULTURNAV_ID_P),
+            cache_max_age)
 
         # set up WikidataStuff instance
-        self.wd = WD(self.repo, self.EDIT_SUMMARY)
+        self.wd = CachedWD(self.repo, self.EDIT_SUMMARY)
 
-        # load lists
-        self.COUNTRIES = wdqsLookup.wdq_to_wdqs(u'TREE[6256][][31]')
-        self.ADMIN_UNITS = wdqsLookup.wdq_to_wdqs(u'TREE[15284][][31]')
+        # load sets
+        self.COUNTRIES = self.load_query_results(u'TREE[6256][][31]')
+        self.ADMIN_UNITS = self.load_query_results(u'TREE[15284][][31]')
+        self.locations = self.load_locations()
 
     @classmethod
     def set_variables(cls, dataset_q=None, dataset_id=None, entity_type=None,
@@ -274,37 +571,33 @@ class KulturnavBot(object):
         param shuffle: whether name/label/alias is shuffled or not
                        i.e. if name = last, first
         """
+        # Required rules/values to search for
+        rules = {
+            u'identifier': None,
+            u'modified': None,
+            u'seeAlso': None,
+            u'sameAs': None,
+            u'exactMatch': None,
+            # not expected
+            u'wikidata': None,
+            u'libris-id': None,
+            u'viaf-id': None,
+            u'getty_aat': None,
+            u'ulan': None
+        }
+        rules.update(datasetRules)
+
         count = 0
-        for hit in self.generator:
+        self.completed = False
+        for values in self.get_preloaded_values(
+                self.get_prepared_values(rules)):
             # print count, self.cutoff
             if self.cutoff and count >= self.cutoff:
                 break
             # some type of feedback
             if count % 100 == 0 and count > 0:
                 pywikibot.output('%d entries handled...' % count)
-            # Required rules/values to search for
-            rules = {
-                u'identifier': None,
-                u'modified': None,
-                u'seeAlso': None,
-                u'sameAs': None,
-                u'exactMatch': None,
-                # not expected
-                u'wikidata': None,
-                u'libris-id': None,
-                u'viaf-id': None,
-                u'getty_aat': None,
-                u'ulan': None
-            }
-            rules.update(datasetRules)
-
-            # put together empty dict of values then populate
-            values = {}
-            for k in rules.keys():
-                values[k] = None
-            if not self.populateValues(values, rules, hit):
-                # continue with next hit if problem was encounterd
-                continue
+                self.output_queue_depths()
 
             # find the matching wikidata item
             hitItem = self.wikidataMatch(values)
@@ -331,6 +624,9 @@ class KulturnavBot(object):
                 if not datasetSanityTest(self, hitItem):
                     continue
 
+                if self.batch_edits:
+                    self.batch = BatchEdit(self.wd, hitItem, self.EDIT_SUMMARY)
+
                 # add name as label/alias
                 if label is not None:
                     self.addNames(values[label], hitItem, shuffle=shuffle)
@@ -342,13 +638,424 @@ class KulturnavBot(object):
                 # add each property (if new) and source it
                 self.addProperties(protoclaims, hitItem, ref)
 
+                if self.batch:
+                    self.batch.submit()
+                    self.batch = None
+                    # the cached copy no longer reflects the item
+                    self.wd.entity_cache.pop(hitItem.title(), None)
+
             # allow for limited runs
             count += 1
+        else:
+            self.completed = True
 
         # done
+        self.save_locations()
         pywikibot.output(u'Handled %d entries' % count)
 
-    def populateValues(self, values, rules, hit):
+    def prepare_values(self, rules, hit, rule_index=None):
+        """Populate the values for a hit, unless it should be skipped.
+
+        This only relies on the KulturNav data and makes no Wikidata reads.
+
+        @param rules: the rules to resolve
+        @type rules: dict
+        @param hit: a kulturnav entry
+        @type hit: dict
+        @param rule_index: the output of Rule.compile_rules(rules), if
+            already available
+        @type rule_index: dict
+        @return: the populated values or None if the hit should be skipped
+        @rtype: dict or None
+        """
+        # put together empty dict of values then populate
+        values = {}
+        for k in rules.keys():
+            values[k] = None
+        problem_free = self.populateValues(values, rules, hit, rule_index)
+        self.register_modified(values[u'modified'])
+        if not problem_free:
+            # continue with next hit if problem was encounterd
+            return None
+
+        # skip entries which are unchanged since the last completed run
+        if not self.is_modified_since(values[u'modified']):
+            return None
+        return values
+
+    def get_prepared_values(self, rules):
+        """Yield the populated values of each hit which should be handled.
+
+        If self.pipeline_size is set then the hits are fetched, and their
+        rules resolved, by a separate thread which runs ahead of the caller
+        feeding a queue of at most that size.
+
+        @param rules: the rules to resolve
+        @type rules: dict
+        @yield: dict
+        """
+        # only compile the rules once per run
+        rule_index = Rule.compile_rules(rules)
+
+        if not self.pipeline_size:
+            for hit in self.generator:
+                values = self.prepare_values(rules, hit, rule_index)
+                if values is not None:
+                    yield values
+            return
+
+        done = object()  # marks the end of the hits
+        stop = threading.Event()
+        self.pipeline_queue = Queue.Queue(maxsize=self.pipeline_size)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    self.pipeline_queue.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def produce():
+            try:
+                for hit in self.generator:
+                    values = self.prepare_values(rules, hit, rule_index)
+                    if values is not None:
+                        put(values)
+                    if stop.is_set():
+                        return
+            except Exception as e:  # hand over to the consuming thread
+                put(e)
+            put(done)
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                item = self.pipeline_queue.get()
+                if item is done:
+                    return
+                elif isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            self.pipeline_queue = None
+
+    def get_preloaded_values(self, values_generator):
+        """Preload the Wikidata entities needed by the next batch of hits.
+
+        If self.preload_size is set then the values are handled in batches
+        of that size. The entities needed by each batch are loaded with
+        batched requests before the batch is passed on. The entity cache is
+        emptied between batches.
+
+        @param values_generator: generator of populated values
+        @type values_generator: generator
+        @yield: dict
+        """
+        if not self.preload_size:
+            for values in values_generator:
+                yield values
+            return
+
+        while True:
+            batch = list(itertools.islice(values_generator, self.preload_size))
+            if not batch:
+                return
+            self.wd.entity_cache.clear()
+            uuids = set()
+            for values in batch:
+                uuids.update(self.find_location_uuids(values))
+            self.resolve_locations(uuids)
+            qids = set()
+            for values in batch:
+                qids.update(self.find_entity_ids(values))
+            self.wd.preload(qids)
+            for values in batch:
+                yield values
+
+    def find_entity_ids(self, values):
+        """Identify the Wikidata entities a hit is likely to need.
+
+        These are the matching item (both the one linked from KulturNav and
+        the one linked from Wikidata, in case one is a redirect) and any
+        item matched to a kulturnav uuid among the values, such as
+        locations and shipyards.
+
+        @param values: the values extracted using the rules
+        @type values: dict
+        @return: the Q-ids
+        @rtype: set of str
+        """
+        qids = set()
+        if helpers.is_str(values.get(u'wikidata')) and \
+                re.match(r'^Q\d+$', values[u'wikidata']):
+            qids.add(values[u'wikidata'])
+        for value in KulturnavBot.iterate_strings(values.values()):
+            uuid = value.split('/')[-1]
+            if uuid in self.itemIds:
+                qids.add(u'Q%s' % self.itemIds[uuid])
+            elif self.locations.get(uuid):
+                qids.add(u'Q%s' % self.locations[uuid])
+        return qids
+
+    def find_location_uuids(self, values):
+        """Identify the kulturnav places among the values of a hit.
+
+        @param values: the values extracted using the rules
+        @type values: dict
+        @return: the uuids of any places not yet matched
+        @rtype: set of str
+        """
+        uuids = set()
+        for key in self.LOCATION_KEYS:
+            if not values.get(key):
+                continue
+            for value in helpers.listify(values[key]):
+                if isinstance(value, dict):
+                    value = value.get(u'location')
+                if value and self.is_uuid(value):
+                    uuid = value.split('/')[-1]
+                    if uuid not in self.locations:
+                        uuids.add(uuid)
+        return uuids
+
+    def resolve_locations(self, uuids):
+        """Match a number of kulturnav places to Wikidata at once.
+
+        Works as location2Wikidata() but retrieves the geo sources of all
+        of the places concurrently and then matches all of the found
+        municipality, county and GeoNames codes using a single query. As
+        there, the codes of a place are tried in order until one has a
+        single match. The results are added to self.locations. Places with
+        sources which cannot be handled are left to location2Wikidata().
+
+        @param uuids: the uuids of the places to match
+        @type uuids: iterable of str
+        """
+        uuids = [uuid for uuid in set(uuids) if uuid not in self.locations]
+        if not uuids:
+            return
+
+        limiter = RateLimiter(self.rate)
+
+        def get_geo_sources(uuid):
+            limiter.wait()
+            return self.get_geo_sources(uuid)
+
+        pool = ThreadPool(max(self.workers, 1))
+        try:
+            all_sources = pool.map(get_geo_sources, uuids)
+        finally:
+            pool.terminate()
+
+        codes = {}  # uuid to candidate (prop, code) pairs, in order
+        for uuid, sources in zip(uuids, all_sources):
+            try:
+                candidates = list(
+                    KulturnavBot.iterate_kulturarvsdata_codes(sources))
+            except pywikibot.Error:
+                continue
+            geonames = KulturnavBot.extract_geonames(sources)
+            if geonames:
+                candidates.append((self.GEONAMES_ID_P, geonames))
+            codes[uuid] = candidates
+        matches = self.match_codes(
+            set(code for candidates in codes.values() for code in candidates))
+
+        for uuid, candidates in codes.iteritems():
+            q = None
+            for prop, code in candidates:
+                if len(matches.get((prop, code), [])) == 1:
+                    q = matches[(prop, code)][0]
+                    if prop != self.GEONAMES_ID_P:
+                        self.ADMIN_UNITS.add(q)
+                    break
+            self.locations[uuid] = q
+
+    @staticmethod
+    def match_codes(codes):
+        """Find the items holding any of a number of identifiers.
+
+        @param codes: (property number, identifier) pairs to look up
+        @type codes: set of tuples
+        @return: the matching Q-numbers per pair
+        @rtype: dict
+        """
+        if not codes:
+            return {}
+        query = (
+            u'SELECT ?item ?prop ?value WHERE { '
+            u'VALUES (?prop ?value) { %s } '
+            u'?item ?prop ?value . }' % u' '.join(
+                u'(wdt:P%s "%s")' % (prop, value)
+                for prop, value in sorted(codes)))
+        matches = {}
+        for result in wdqsLookup.make_simple_wdqs_query(query):
+            prop = result['prop'].split('/')[-1][len(u'P'):]
+            q = int(result['item'].split('/')[-1][len(u'Q'):])
+            matches.setdefault((prop, result['value']), []).append(q)
+        return matches
+
+    def load_locations(self):
+        """Load the stored location matches which are still fresh.
+
+        Any stored match to an administrative unit is also added to
+        self.ADMIN_UNITS.
+
+        @return: uuid to Q-number
+        @rtype: dict
+        """
+        filename = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), self.LOCATIONS_FILE)
+        try:
+            with open(filename) as f:
+                stored = json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+        locations = {}
+        for uuid, entry in stored.iteritems():
+            if entry['q'] is None:
+                continue  # stored by an earlier version
+            if time.time() - entry['retrieved'] < self.cache_max_age:
+                locations[uuid] = entry['q']
+                self.location_retrieved[uuid] = entry['retrieved']
+                if entry['admin_unit']:
+                    self.ADMIN_UNITS.add(entry['q'])
+        return locations
+
+    def save_locations(self):
+        """Store the location matches for use by later runs.
+
+        Unmatched places are not stored, so that later runs try them again.
+        """
+        filename = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), self.LOCATIONS_FILE)
+        now = time.time()
+        stored = {}
+        for uuid, q in self.locations.iteritems():
+            if q is None:
+                continue
+            stored[uuid] = {
+                'q': q,
+                'retrieved': self.location_retrieved.setdefault(uuid, now),
+                'admin_unit': q in self.ADMIN_UNITS}
+        with open(filename, 'w') as f:
+            json.dump(stored, f)
+
+    @staticmethod
+    def iterate_strings(value):
+        """Yield every string within a (nested) structure of lists and dicts.
+
+        @param value: the structure to look in
+        @type value: str, list, dict or None
+        @yield: str
+        """
+        if helpers.is_str(value):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                for s in KulturnavBot.iterate_strings(v):
+                    yield s
+        elif isinstance(value, dict):
+            for v in value.values():
+                for s in KulturnavBot.iterate_strings(v):
+                    yield s
+
+    def output_queue_depths(self):
+        """Output the number of entries waiting at each pipeline stage."""
+        if self.pipeline_queue is None:
+            return
+        fetched = getattr(self.generator, 'depth', None)
+        pywikibot.output(
+            u'Queue depths: %s being fetched, %d resolved' % (
+                u'?' if fetched is None else fetched,
+                self.pipeline_queue.qsize()))
+
+    def register_modified(self, modified):
+        """Keep track of the latest modified timestamp encountered.
+
+        @param modified: the "modified" value of an entry
+        @type modified: str or None
+        """
+        if not helpers.is_str(modified):
+            return
+        if self.latest_modified is None or modified > self.latest_modified:
+            self.latest_modified = modified
+
+    def is_modified_since(self, modified):
+        """Check if an entry was modified after the high-water mark.
+
+        Entries lacking a (single) modified timestamp are always treated as
+        modified.
+
+        @param modified: the "modified" value of an entry
+        @type modified: str or None
+        @rtype: bool
+        """
+        if self.since is None or not helpers.is_str(modified):
+            return True
+        return modified > self.since
+
+    @classmethod
+    def get_state_file(cls):
+        """Return the path to the file holding the high-water marks."""
+        return os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), cls.STATE_FILE)
+
+    @classmethod
+    def load_high_water_mark(cls):
+        """Load the high-water mark for the current dataset.
+
+        @return: the latest modified timestamp of the last completed run
+        @rtype: str or None
+        """
+        try:
+            with open(cls.get_state_file()) as f:
+                marks = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return marks.get(cls.DATASET_ID)
+
+    @classmethod
+    def save_high_water_mark(cls, modified):
+        """Store the high-water mark for the current dataset.
+
+        @param modified: the latest modified timestamp of a completed run
+        @type modified: str
+        """
+        marks = {}
+        try:
+            with open(cls.get_state_file()) as f:
+                marks = json.load(f)
+        except (IOError, ValueError):
+            pass
+        marks[cls.DATASET_ID] = modified
+        with open(cls.get_state_file(), 'w') as f:
+            json.dump(marks, f, indent=4, sort_keys=True)
+
+    def load_query_results(self, wdq_query):
+        """Return the results of a wdq query, reusing any stored results.
+
+        Results are stored locally and reused for as long as they are
+        younger than self.cache_max_age.
+
+        @param wdq_query: the wdq query, run as the equivalent wdqs query
+        @type wdq_query: str
+        @return: the matching Q-numbers
+        @rtype: set of int
+        """
+        filename = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), self.QUERY_CACHE_FILE)
+        return set(load_query_results(
+            filename, wdq_query,
+            lambda: sorted(set(wdqsLookup.wdq_to_wdqs(wdq_query))),
+            self.cache_max_age))
+
+    def populateValues(self, values, rules, hit, rule_index=None):
         """
         Populate values and check results given a hit.
 
@@ -362,35 +1069,40 @@ class KulturnavBot(object):
             None: the exakt key is present in hit and its value is wanted
             a Rule: acording to the class above
         param hit: a kulturnav entry
+        param rule_index: the output of Rule.compile_rules(rules), if
+            already available
         return bool problemFree
         """
+        if rule_index is None:
+            rule_index = Rule.compile_rules(rules)
+
         ids = {}
         problemFree = True
         for entries in hit[u'@graph']:
             # populate ids for viaId rules
-            if '@id' in entries.keys():
-                if entries['@id'] in ids.keys():
+            if '@id' in entries:
+                if entries['@id'] in ids:
                     pywikibot.output('Non-unique viaID key: \n%s\n%s' %
                                      (entries, ids[entries['@id']]))
                 ids[entries['@id']] = entries
 
         for entries in hit[u'@graph']:
-            # handle rules
-            for key, rule in rules.iteritems():
-                val = None
-                if rule is None:
-                    if key in entries.keys():
+            # handle only the rules which could match this entry
+            for target in entries:
+                for key, rule in rule_index.get(target, ()):
+                    if rule is None:
                         val = entries[key]
-                elif isinstance(rule, Rule):
-                    val = rule.resolve(entries, ids)
-
-                # test and register found value
-                if val is not None:
-                    if values[key] is None:
-                        values[key] = val
                     else:
-                        pywikibot.output(u'duplicate entries for %s' % key)
-                        problemFree = False
+                        val = rule.resolve(entries, ids)
+
+                    # test and register found value
+                    if val is not None:
+                        if values[key] is None:
+                            values[key] = val
+                        else:
+                            pywikibot.output(
+                                u'duplicate entries for %s' % key)
+                            problemFree = False
 
         # the minimum which must have been identified
         if values[u'identifier'] is None:
@@ -620,12 +1332,28 @@ class KulturnavBot(object):
                     for val in pcvalue:
                         # check if None or a Statement(None)
                         if (val is not None) and (not val.isNone()):
-                            self.wd.addNewClaim(pcprop, val, hitItem, ref)
-                            # reload item so that next call is aware of changes
-                            hitItem = self.wd.QtoItemPage(hitItem.title())
-                            hitItem.exists()
+                            self.add_claim(pcprop, val, hitItem, ref)
                 elif not pcvalue.isNone():
-                    self.wd.addNewClaim(pcprop, pcvalue, hitItem, ref)
+                    self.add_claim(pcprop, pcvalue, hitItem, ref)
+
+    def add_claim(self, prop, statement, item, ref):
+        """
+        Add a claim (if new) and source it, without reloading the item.
+
+        @param prop: the property of the claim
+        @type prop: str
+        @param statement: the statement to add
+        @type statement: WD.Statement
+        @param item: the target entity
+        @type item: pywikibot.ItemPage
+        @param ref: the reference to add
+        @type ref: WD.Reference
+        """
+        if self.batch:
+            self.batch.add_claim(prop, statement, ref)
+            return
+        edit_item(
+            item, lambda i: self.wd.addNewClaim(prop, statement, i, ref))
 
     # KulturNav specific functions
     def dbpedia2Wikidata(self, item):
@@ -805,19 +1533,35 @@ class KulturnavBot(object):
         @rtype: str or None
         @raises pywikibot.Error
         """
+        for code in KulturnavBot.iterate_kulturarvsdata_codes(sources):
+            # only here if a municipality or county was found
+            wdq_query = u'STRING[%s:"%s"]' % code
+            wdq_result = wdqsLookup.wdq_to_wdqs(wdq_query)
+            if wdq_result and len(wdq_result) == 1:
+                self.ADMIN_UNITS.add(wdq_result[0])
+                return wdq_result[0]
+        return None
+
+    @staticmethod
+    def iterate_kulturarvsdata_codes(sources):
+        """Yield every municipality or county code given get_geo_sources().
+
+        The codes are yielded in the order of the sources.
+
+        @param sources: output of get_geo_sources()
+        @type sources: list of dicts
+        @return: the property number and the code of each
+        @rtype: generator of tuples of str
+        @raises pywikibot.Error
+        """
         needle = u'http://kulturarvsdata.se/resurser/aukt/geo/'
         for s in sources:
             if s.get('value') and s.get('value').startswith(needle):
                 s = s.get('value').split('/')[-1]
-                wdq_query = None
                 if s.startswith('municipality#'):
-                    code = s.split('#')[-1]
-                    wdq_query = u'STRING[%s:"%s"]' % (self.SWE_KOMMUNKOD_P,
-                                                      code)
+                    yield (KulturnavBot.SWE_KOMMUNKOD_P, s.split('#')[-1])
                 elif s.startswith('county#'):
-                    code = s.split('#')[-1]
-                    wdq_query = u'STRING[%s:"%s"]' % (self.SWE_COUNTYKOD_P,
-                                                      code)
+                    yield (KulturnavBot.SWE_COUNTYKOD_P, s.split('#')[-1])
                 elif s.startswith('country#'):
                     pass  # handle via geonames instead
                 elif s.startswith('parish#'):
@@ -826,14 +1570,6 @@ class KulturnavBot(object):
                     raise pywikibot.Error(u'Unhandled KulturarvsdataLocation '
                                           u'prefix: %s' % s)
 
-                if wdq_query:
-                    # only here if a municipality or county was found
-                    wdq_result = wdqsLookup.wdq_to_wdqs(wdq_query)
-                    if wdq_result and len(wdq_result) == 1:
-                        self.ADMIN_UNITS.append(wdq_result[0])
-                        return wdq_result[0]
-        return None
-
     def getLocationProperty(self, item, strict=True):
         """
         Return appropriate location property for an item.
@@ -883,7 +1619,7 @@ class KulturnavBot(object):
         if uuid.startswith(u'http://kulturnav.org'):
             uuid = uuid.split('/')[-1]
 
-        if uuid in self.itemIds.keys():
+        if uuid in self.itemIds:
             qNo = u'Q%d' % self.itemIds[uuid]
             return self.wd.QtoItemPage(qNo)
         else:
@@ -985,44 +1721,99 @@ class KulturnavBot(object):
         if isinstance(name_obj, list):
             for n in name_obj:
                 self.add_label_or_alias(n, item, case_sensitive=case_sensitive)
-                # reload item so that next call is aware of any changes
-                item = self.wd.QtoItemPage(item.title())
-                item.exists()
             return
 
         # for a single entry
-        self.wd.addLabelOrAlias(name_obj['@language'], name_obj['@value'],
-                                item, caseSensitive=case_sensitive)
+        lang = name_obj['@language']
+        name = name_obj['@value']
+        if self.batch:
+            self.batch.add_label_or_alias(lang, name, case_sensitive)
+            return
+
+        revision = item.latest_revision_id
+        edit_item(
+            item, lambda i: self.wd.addLabelOrAlias(
+                lang, name, i, caseSensitive=case_sensitive))
+
+        # if edited then make the local copy aware of the new name
+        if item.latest_revision_id != revision:
+            KulturnavBot.apply_label_or_alias(lang, name, item)
 
     @staticmethod
-    def get_kulturnav_generator(uuids, delay=0):
+    def apply_label_or_alias(lang, name, item):
+        """Add a name to the local copy of an item as a label or an alias.
+
+        Mirrors the edit made by addLabelOrAlias() so that the item need
+        not be reloaded before the next name is added.
+
+        @param lang: the language code
+        @type lang: str
+        @param name: the name to add
+        @type name: str
+        @param item: the item to which the name was added
+        @type item: pywikibot.ItemPage
+        """
+        if lang not in item.labels:
+            item.labels[lang] = name
+        elif name != item.labels[lang]:
+            aliases = item.aliases.setdefault(lang, [])
+            if name not in aliases:
+                aliases.append(name)
+
+    @staticmethod
+    def get_kulturnav_generator(uuids, delay=0, workers=1, rate=None,
+                                cache_max_age=False, modified=None):
         """Generate KulturNav items from a list of uuids.
 
+        The items are yielded in the same order as the uuids, also when
+        they are fetched concurrently.
+
         @param uuids: uuids to request items for
         @type uuids: list of str
-        @param delay: delay in seconds between each kulturnav request
+        @param delay: delay in seconds between each kulturnav request, only
+            used if there is a single worker
         @type delay: int
-        @yield: dict
+        @param workers: number of kulturnav requests to run concurrently
+        @type workers: int
+        @param rate: max number of kulturnav requests per second
+        @type rate: float or None
+        @param cache_max_age: max age (in seconds) of locally stored
+            kulturnav records to reuse. None means that stored records never
+            expire and False that no local store is used.
+        @type cache_max_age: int, None or bool
+        @param modified: uuid to the "modified" timestamp reported by the
+            search, used to check that locally stored records are current
+        @type modified: dict or None
+        @return: iterable yielding dicts
+        @rtype: KulturnavFetcher
         """
-        for uuid in uuids:
-            time.sleep(delay)
-            try:
-                json_data = KulturnavBot.get_single_entry(uuid)
-            except pywikibot.Error as e:
-                pywikibot.output(e)
-            else:
-                yield json_data
+        cache = None
+        if cache_max_age is not False:
+            cache = KulturnavCache(cache_max_age)
+        return KulturnavFetcher(uuids, workers=workers, rate=rate,
+                                delay=delay, cache=cache, modified=modified)
 
     @classmethod
-    def get_search_results(cls, max_hits=250, require_wikidata=True):
+    def get_search_results(cls, max_hits=250, require_wikidata=True,
+                           workers=1, since=None, modified=None):
         """Make a KulturNav search for all items of a given type in a dataset.
 
+        Hits for which the search reports a "modified" timestamp can be
+        filtered on it, saving the request for the full record.
+
         @param max_hits: the maximum number of results to request at once
         @type max_hits: int
         @param require_wikidata: whether to filter results on having a wikidata
             url in sameAs
         @type require_wikidata: bool
-        @return: the resulting uuids
+        @param workers: the number of search pages to request at once
+        @type workers: int
+        @param since: skip hits not modified after this timestamp
+        @type since: str or None
+        @param modified: dict to which the reported "modified" timestamp of
+            each resulting uuid is added
+        @type modified: dict or None
+        @return: the resulting uuids, without duplicates
         @rtype: list of str
         """
         search_url = 'http://kulturnav.org/api/search/' + \
@@ -1037,28 +1828,91 @@ class KulturnavBot(object):
         else:
             search_url += '/%d/%d'
 
-        # start search
+        # run search
         results = []
-        offset = 0
-        overview_page = KulturnavBot.get_single_search_results(
-            search_url, q, offset, max_hits)
-        while overview_page:
+        seen = set()
+        num_unchanged = 0
+        for overview_page in KulturnavBot.get_search_pages(
+                search_url, q, max_hits, workers=workers):
             for item in overview_page:
                 uuid = item[u'uuid']
-                if not require_wikidata or \
+                if uuid in seen:
+                    continue
+                if require_wikidata and not \
                         KulturnavBot.has_wikidata_in_sameas(item, cls.MAP_TAG):
-                    results.append(uuid)
-
-            # continue
-            offset += max_hits
-            overview_page = KulturnavBot.get_single_search_results(
-                search_url, q, offset, max_hits)
+                    continue
+                seen.add(uuid)
+                hit_modified = KulturnavBot.get_hit_modified(item)
+                if since and hit_modified and hit_modified <= since:
+                    num_unchanged += 1
+                    continue
+                results.append(uuid)
+                if modified is not None and hit_modified:
+                    modified[uuid] = hit_modified
 
         # some feedback
         pywikibot.output(u'Found %d matching entries in Kulturnav'
                          % len(results))
+        if num_unchanged:
+            pywikibot.output(u'Skipped %d entries unchanged since %s'
+                             % (num_unchanged, since))
         return results
 
+    @staticmethod
+    def get_hit_modified(item):
+        """Return the "modified" timestamp of a search hit, if reported.
+
+        @param item: the search item
+        @type item: dict
+        @rtype: str or None
+        """
+        modified = item.get(u'modified')
+        if not modified:
+            values = item.get(u'properties', {}).get(u'modified') or []
+            modified = values[0].get(u'value') if values else None
+        return modified if helpers.is_str(modified) else None
+
+    @staticmethod
+    def get_search_pages(search_url, q, max_hits, workers=1):
+        """Retrieve all of the pages of an API search, in order.
+
+        The search API does not report the total number of hits. With more
+        than one worker the next few offset windows are therefore requested
+        at once, until an empty page is encountered.
+
+        @param search_url: basic url from which to build search
+        @type search_url: str
+        @param q: the map_tag query, if any
+        @type q: str or None
+        @param max_hits: the maximum number of results to request at once
+        @type max_hits: int
+        @param workers: the number of pages to request at once
+        @type workers: int
+        @yield: list of dict
+        """
+        def fetch(offset):
+            return KulturnavBot.get_single_search_results(
+                search_url, q, offset, max_hits)
+
+        workers = max(1, workers)
+        pool = ThreadPool(workers) if workers > 1 else None
+        offset = 0
+        try:
+            while True:
+                offsets = [offset + i * max_hits for i in range(workers)]
+                if pool:
+                    pages = pool.map(fetch, offsets)
+                else:
+                    pages = [fetch(offset)]
+                for page in pages:
+                    if not page:
+                        return
+                    yield page
+                offset += workers * max_hits
+        finally:
+            if pool:
+                pool.terminate()
+
     @staticmethod
     def has_wikidata_in_sameas(item, map_tag):
         """Check if a wikidata url is present in the sameAs property.
@@ -1135,28 +1989,57 @@ class KulturnavBot(object):
     def main(cls, *args):
         """Start the bot from the command line."""
         options = cls.handle_args(args)
+        if options['incremental'] and options['kulturnav_cache'] is None:
+            # a record which never expires would never pass the mark
+            pywikibot.error(u'-incremental cannot be combined with a never '
+                            u'expiring -kulturnav_cache, give it a max age')
+            return
 
+        since = None
+        if options['incremental']:
+            since = cls.load_high_water_mark()
+        modified = {}
         search_results = cls.get_search_results(
             max_hits=options['max_hits'],
-            require_wikidata=options['require_wikidata'])
+            require_wikidata=options['require_wikidata'],
+            workers=options['workers'], since=since, modified=modified)
         kulturnav_generator = cls.get_kulturnav_generator(
-            search_results, delay=options['delay'])
+            search_results, delay=options['delay'],
+            workers=options['workers'], rate=options['rate'],
+            cache_max_age=options['kulturnav_cache'], modified=modified)
 
         kulturnav_bot = cls(kulturnav_generator, options['cache_max_age'])
         kulturnav_bot.cutoff = options['cutoff']
         kulturnav_bot.require_wikidata = options['require_wikidata']
+        kulturnav_bot.pipeline_size = options['pipeline']
+        kulturnav_bot.preload_size = options['preload']
+        kulturnav_bot.batch_edits = options['batch_edits']
+        kulturnav_bot.workers = options['workers']
+        kulturnav_bot.rate = options['rate']
+        kulturnav_bot.since = since
         kulturnav_bot.run()
 
+        # only a run which saw every entry may move the high-water mark
+        if kulturnav_bot.completed and kulturnav_bot.latest_modified:
+            cls.save_high_water_mark(kulturnav_bot.latest_modified)
+
     @classmethod
     def run_from_list(cls, uuids, *args):
         """Start the bot with a list of uuids."""
         options = cls.handle_args(args)
 
         kulturnav_generator = cls.get_kulturnav_generator(
-            uuids, delay=options['delay'])
+            uuids, delay=options['delay'],
+            workers=options['workers'], rate=options['rate'],
+            cache_max_age=options['kulturnav_cache'])
         kulturnav_bot = cls(kulturnav_generator, options['cache_max_age'])
         kulturnav_bot.cutoff = options['cutoff']
         kulturnav_bot.require_wikidata = False
+        kulturnav_bot.pipeline_size = options['pipeline']
+        kulturnav_bot.preload_size = options['preload']
+        kulturnav_bot.batch_edits = options['batch_edits']
+        kulturnav_bot.workers = options['workers']
+        kulturnav_bot.rate = options['rate']
         kulturnav_bot.run()
 
     @staticmethod
@@ -1174,8 +2057,15 @@ class KulturnavBot(object):
             'cutoff': None,
             'max_hits': 250,
             'delay': 0,
+            'workers': 1,
+            'rate': None,
             'require_wikidata': True,
             'cache_max_age': 0,
+            'kulturnav_cache': False,
+            'incremental': False,
+            'pipeline': 0,
+            'preload': 0,
+            'batch_edits': False,
         }
 
         for arg in pywikibot.handle_args(args):
@@ -1186,10 +2076,24 @@ class KulturnavBot(object):
                 options['max_hits'] = int(value)
             elif option == '-delay':
                 options['delay'] = int(value)
+            elif option == '-workers':
+                options['workers'] = int(value)
+            elif option == '-rate':
+                options['rate'] = float(value)
             elif option == '-any_item':
                 options['require_wikidata'] = False
             elif option == '-wdq_cache':
                 options['cache_max_age'] = int(value)
+            elif option == '-kulturnav_cache':
+                options['kulturnav_cache'] = int(value) if value else None
+            elif option == '-incremental':
+                options['incremental'] = True
+            elif option == '-pipeline':
+                options['pipeline'] = int(value)
+            elif option == '-preload':
+                options['preload'] = int(value)
+            elif option == '-batch_edits':
+                options['batch_edits'] = True
 
         return options
 
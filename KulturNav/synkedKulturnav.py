@@ -13,6 +13,8 @@ import wikidataStuff.wdqsLookup as wdqsLookup
 import wikidataStuff.helpers as helpers
 from kulturnavBot import KulturnavBot
 
+SEARCH_WORKERS = 4  # number of search pages to request at once
+
 
 def get_wdq(dataset=None, data=None):
     """Find all links from Wikidata to Kulturnav using WDQ.
@@ -96,20 +98,13 @@ def get_kulturnav(dataset=None, data=None):
     matched_tags = ['entity.sameAs_s', 'concept.exactMatch_s']
 
     for match in matched_tags:
-        offset = 0
         search_url = urlbase + match + ':%s/%d/%d'
-        search_data = KulturnavBot.get_single_search_results(
-            search_url, search_str, offset, batch_size)
         tag = match.split('_')[0]
 
-        while search_data:
+        for search_data in KulturnavBot.get_search_pages(
+                search_url, search_str, batch_size, workers=SEARCH_WORKERS):
             find_kulturnav_matches(search_data, tag, data)
 
-            # continue
-            offset += batch_size
-            search_data = KulturnavBot.get_single_search_results(
-                search_url, search_str, offset, batch_size)
-
     return data
 
 
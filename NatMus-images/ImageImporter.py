@@ -8,20 +8,50 @@ The source data are the LIDO files used for the image import (into Commons).
 &params;
 """
 import codecs
+import io
+import itertools
+import json
+import mmap
+import numbers
 import os.path as path
+import sys
 
 import pywikibot
 
 import wikidataStuff.helpers as helpers
 from wikidataStuff.WikidataStuff import WikidataStuff as WD
 import wikidataStuff.wdqsLookup as wdqsLookup
+
+try:
+    from batchtools import BatchEdit, preload_items
+    from batchtools.preload import MAX_ENTITIES
+except ImportError:  # run from within its project directory
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    from batchtools import BatchEdit, preload_items
+    from batchtools.preload import MAX_ENTITIES
+
 EDIT_SUMMARY = u'import using #NatMus data'
+READ_SIZE = 2 ** 16  # number of characters read at a time from large files
+MAX_NUMBER_TAIL = 2  # max length of a cut off number tail, e.g. "e-"
+COMMONS_URL = u'https://commons.wikimedia.org/wiki/File:'
 
 usage = u"""
 Usage:            python NatMus-images/ImageImporter.py [OPTIONS]
                   with options:
 
 -rows:INT         Number of entries to process (default: All)
+
+-batch[:INT]      Load the paintings in groups of this size (default: 50),
+                  compare them to the LIDO data locally and only edit the
+                  paintings which change, each in a single edit
+
+-dry_run          Only report the number of paintings which would be edited,
+                  and what would change for each in the log file. Implies
+                  -batch.
+
+-convert_lido     Convert processed_lido.json to processed_lido.jsonl, with
+                  one painting per line, and exit. The converted file is
+                  then read in place of the original one.
 """
 docuReplacements = {'&params;': usage}
 
@@ -35,6 +65,9 @@ class PaintingsImageBot:
         self.generator = dict_generator
         self.repo = pywikibot.Site().data_repository()
         self.wd = WD(self.repo, edit_summary=EDIT_SUMMARY)
+        self.batch_size = None  # If paintings are loaded and edited in bulk
+        self.dry_run = False  # If batched edits are only reported
+        self.batch = None  # BatchEdit for the current painting
 
         # Set log file
         out_dir = path.join(path.split(__file__)[0])
@@ -45,12 +78,69 @@ class PaintingsImageBot:
         """Start the robot."""
         self.creators = {}
 
+        if self.batch_size or self.dry_run:
+            self.run_batched()
+            return
+
         for painting_data in self.generator:
             # isolate ids
             lido_data, qid, commons_file = painting_data
             painting_item = self.wd.QtoItemPage(qid)
             self.process_painting(painting_item, lido_data, commons_file)
 
+    def run_batched(self):
+        """Process the paintings in groups, only editing those which change.
+
+        Each group of paintings is loaded in bulk and each painting is then
+        compared to its LIDO data locally. Any changes are submitted in a
+        single edit, or only reported if this is a dry run.
+        """
+        batch_size = self.batch_size or MAX_ENTITIES
+        num_paintings = 0
+        num_changed = 0
+        num_uncertain = 0  # only changed if addNewClaim() finds them new
+        while True:
+            group = list(itertools.islice(self.generator, batch_size))
+            if not group:
+                break
+            items = preload_items(self.repo, [qid for _, qid, _ in group])
+            for lido_data, qid, commons_file in group:
+                item = items.get(qid) or self.wd.QtoItemPage(qid)
+                self.batch = BatchEdit(self.wd, item, EDIT_SUMMARY)
+                self.process_painting(item, lido_data, commons_file)
+                num_paintings += 1
+
+                if self.dry_run:
+                    data, remaining = self.batch.make_data()
+                    if data:
+                        num_changed += 1
+                        self.log.write(u"%s: would change %s\n" % (
+                            item.title(), u', '.join(sorted(data.keys()))))
+                    elif remaining:
+                        num_uncertain += 1
+                    if remaining:
+                        self.log.write(u"%s: would check %s\n" % (
+                            item.title(), u', '.join(
+                                sorted(set(r[0] for r in remaining)))))
+                else:
+                    try:
+                        if self.batch.submit():
+                            num_changed += 1
+                    except pywikibot.data.api.APIError as e:
+                        # e.g. a rejected label, as in check_and_add_labels()
+                        self.log.write(u"%s: had an error: %s\n" % (
+                            item.title(), e))
+                self.batch = None
+
+        if self.dry_run:
+            pywikibot.output(
+                u'%d of %d paintings would be edited, %d more might be '
+                u'after a closer check of their claims' % (
+                    num_changed, num_paintings, num_uncertain))
+        else:
+            pywikibot.output(u'Edited %d of %d paintings' % (
+                num_changed, num_paintings))
+
     def process_painting(self, item, lido_data, commons_file):
         """Process a single painting."""
         item.exists()  # load the item
@@ -63,6 +153,23 @@ class PaintingsImageBot:
         self.add_date_claim(item, lido_data, obj_id_ref)
         self.add_dimension_claims(item, lido_data, obj_id_ref)
 
+    def add_claim(self, prop, statement, item, ref):
+        """Add a claim, or queue it if the painting is edited in one go.
+
+        @param prop: the property of the claim
+        @type prop: str
+        @param statement: the statement to add
+        @type statement: WD.Statement
+        @param item: the item to add the claim to
+        @type item: pywikibot.ItemPage
+        @param ref: the reference to add
+        @type ref: WD.Reference|None
+        """
+        if self.batch:
+            self.batch.add_claim(prop, statement, ref)
+        else:
+            self.wd.addNewClaim(prop, statement, item, ref)
+
     def add_dimension_claims(self, item, lido_data, ref):
         """
         Add height/P2048 and width/P2049 claims.
@@ -102,10 +209,10 @@ class PaintingsImageBot:
             site=self.wd.repo)
 
         # make claims
-        self.wd.addNewClaim(
+        self.add_claim(
             height_p, WD.Statement(height),
             item, ref)
-        self.wd.addNewClaim(
+        self.add_claim(
             width_p, WD.Statement(width),
             item, ref)
 
@@ -128,7 +235,7 @@ class PaintingsImageBot:
 
         # make claim
         if wb_date:
-            self.wd.addNewClaim(
+            self.add_claim(
                 prop, WD.Statement(wb_date),
                 item, ref)
 
@@ -142,7 +249,7 @@ class PaintingsImageBot:
             nsid = subject.get(u'other_id')
             if nsid in self.people_items:
                 person_item = self.wd.QtoItemPage(self.people_items[nsid])
-                self.wd.addNewClaim(
+                self.add_claim(
                     prop, WD.Statement(person_item),
                     item, ref)
 
@@ -168,7 +275,7 @@ class PaintingsImageBot:
                     item.claims.get(prop)[0].getTarget().title(),
                     file_page.title()))
         else:
-            self.wd.addNewClaim(
+            self.add_claim(
                 prop, WD.Statement(file_page),
                 item, ref)
 
@@ -180,6 +287,9 @@ class PaintingsImageBot:
         for lang, value in lido_data.get('title').iteritems():
             if lang == '_':
                 continue
+            if self.batch:
+                self.batch.add_label_or_alias(lang, value)
+                continue
             try:
                 self.wd.addLabelOrAlias(
                     lang, value, item,
@@ -259,28 +369,210 @@ def make_labels(lido_data):
     return labels
 
 
-def load_commons_data(filename):
+class CommonsFileIndex(object):
     """
-    Load the local data file on nsid to filenames on Commons.
+    Index of nsid to Commons filename, backed by a memory-mapped csv file.
 
     The file is a csv of the format:
     <nsid>|<source_file.tif>|https://commons.wikimedia.org/wiki/File:<commons_filename.tif>
 
-    The returned format is a dict with nsid as key and (short) commons
-    filename as value.
+    Only the position of each row is held in memory, the filename is read
+    from the file when looked up. If an nsid is repeated the last row wins.
     """
-    commons_data = {}
-    commons_string = u'https://commons.wikimedia.org/wiki/File:'
-    with codecs.open(filename, 'r', 'utf-8') as f:
-        lines = f.read().split('\n')
-        lines.pop(0)  # The first row is just explanation
-        for line in lines:
+
+    def __init__(self, filename):
+        """
+        Index the mapping file.
+
+        @param filename: the csv mapping file
+        @type filename: str
+        """
+        self.offsets = {}  # nsid to position of its row in the file
+        self.data = None
+        with open(filename, 'rb') as f:
+            if path.getsize(filename):
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data is None:
+            return
+
+        self.data.readline()  # The first row is just explanation
+        while True:
+            offset = self.data.tell()
+            line = self.data.readline()
+            if not line:
+                break
             if not line.strip():
                 continue
-            p = line.split('|')
-            commons_name = p[2][len(commons_string):]
-            commons_data[p[0]] = commons_name
-    return commons_data
+            nsid = line[:line.find('|')].decode('utf-8')
+            self.offsets[nsid] = offset
+
+    def __getitem__(self, nsid):
+        """Return the (short) Commons filename of an nsid."""
+        self.data.seek(self.offsets[nsid])
+        line = self.data.readline().decode('utf-8').rstrip(u'\r\n')
+        return line.split(u'|')[2][len(COMMONS_URL):]
+
+    def __contains__(self, nsid):
+        """Check if there is a Commons file for an nsid."""
+        return nsid in self.offsets
+
+    def __len__(self):
+        """Return the number of indexed nsids."""
+        return len(self.offsets)
+
+    def get(self, nsid, default=None):
+        """Return the (short) Commons filename of an nsid, if any."""
+        if nsid not in self.offsets:
+            return default
+        return self[nsid]
+
+    def close(self):
+        """Release the memory-mapped file."""
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+def load_commons_data(filename):
+    """
+    Load the local data file on nsid to filenames on Commons.
+
+    The returned index behaves as a dict with nsid as key and (short)
+    commons filename as value.
+
+    @param filename: the csv mapping file
+    @type filename: str
+    @rtype: CommonsFileIndex
+    """
+    return CommonsFileIndex(filename)
+
+
+def iter_json_object(filename):
+    """
+    Yield the key-value pairs of a large JSON object, one at a time.
+
+    The file is read in chunks and only a single value is held in memory
+    at any one time. Any repeated key is yielded once per occurrence.
+
+    @param filename: the file containing a single JSON object
+    @type filename: str
+    @yield: tuple (key, value)
+    """
+    decoder = json.JSONDecoder()
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        buf = u''
+        pos = 0
+        eof = False
+        state = u'start'
+        key = None
+        while True:
+            # skip whitespace, reading more as needed
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                buf = f.read(READ_SIZE)
+                pos = 0
+                eof = not buf
+            if eof and pos == len(buf):
+                raise ValueError(u'Unexpected end of %s' % filename)
+
+            char = buf[pos]
+            if state in (u'first_key', u'next') and char == u'}':
+                return
+            elif state in (u'start', u'colon', u'next'):
+                delimiter = {u'start': u'{', u'colon': u':', u'next': u','}
+                if char != delimiter[state]:
+                    raise ValueError(u'Expected "%s" but found "%s" in %s' % (
+                        delimiter[state], buf[pos:pos + 20], filename))
+                pos += 1
+                state = {u'start': u'first_key', u'colon': u'value',
+                         u'next': u'key'}[state]
+                continue
+
+            # decode a complete key or value, reading more until possible.
+            # A number cut off by the end of the buffer, e.g. after "12.",
+            # decodes as a shorter number, so these need a longer margin.
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    margin = 0
+                    if isinstance(value, numbers.Number) and \
+                            not isinstance(value, bool):
+                        margin = MAX_NUMBER_TAIL
+                    if end + margin < len(buf) or eof:
+                        break
+                except ValueError:
+                    if eof:
+                        raise
+                more = f.read(READ_SIZE)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+            pos = end
+
+            if state == u'value':
+                yield key, value
+                state = u'next'
+            else:
+                key = value
+                state = u'colon'
+
+
+def iter_json_lines(filename):
+    """
+    Yield the key-value pairs stored in a JSON lines file.
+
+    @param filename: file with a JSON [key, value] list on each line
+    @type filename: str
+    @yield: tuple (key, value)
+    """
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                key, value = json.loads(line)
+                yield key, value
+
+
+def convert_to_json_lines(in_file, out_file):
+    """
+    Convert a file with a single JSON object into a JSON lines file.
+
+    @param in_file: file containing a single JSON object
+    @type in_file: str
+    @param out_file: file to write a JSON [key, value] list per line to
+    @type out_file: str
+    @return: the number of converted entries
+    @rtype: int
+    """
+    counter = 0
+    with io.open(out_file, 'w', encoding='utf-8') as f:
+        for key, value in iter_json_object(in_file):
+            f.write(u'%s\n' % json.dumps([key, value], ensure_ascii=False))
+            counter += 1
+    return counter
+
+
+def load_lido_data(processed_lido):
+    """
+    Stream the processed LIDO data, using the JSON lines copy if present.
+
+    The JSON lines copy is not used if the original file is newer.
+
+    @param processed_lido: the processed LIDO json file
+    @type processed_lido: str
+    @yield: tuple (nsid, lido data)
+    """
+    json_lines = path.splitext(processed_lido)[0] + u'.jsonl'
+    if path.exists(json_lines):
+        if not path.exists(processed_lido) or \
+                path.getmtime(processed_lido) <= path.getmtime(json_lines):
+            return iter_json_lines(json_lines)
+        pywikibot.warning(
+            u'%s is older than %s and is ignored, rerun -convert_lido to '
+            u'update it' % (json_lines, processed_lido))
+    return iter_json_object(processed_lido)
 
 
 def load_offline_data():
@@ -292,7 +584,7 @@ def load_offline_data():
     processed_lido = data_dir + u'processed_lido.json'
 
     local_nsid = helpers.load_json_file(nsid)
-    lido = helpers.load_json_file(processed_lido)
+    lido = load_lido_data(processed_lido)
     commons_data = load_commons_data(commons_names)
 
     return local_nsid, lido, commons_data
@@ -352,11 +644,23 @@ def prepare_data():
 
 
 def get_painting_generator(lido_data, painting_items, commons_data, rows=None):
-    """Get objects from LIDO data."""
+    """
+    Get objects from LIDO data.
+
+    @param lido_data: (nsid, lido data) pairs, e.g. from load_lido_data()
+    @type lido_data: iterable
+    @param painting_items: nsid to Q-id of existing painting items
+    @type painting_items: dict
+    @param commons_data: nsid to Commons filename
+    @type commons_data: dict
+    @param rows: the number of entries to process, None for all
+    @type rows: int
+    @yield: tuple (lido data, Q-id, Commons filename)
+    """
     counter = 0
-    for nsid, data in lido_data.iteritems():
+    for nsid, data in lido_data:
         if not rows or counter < rows:
-            if nsid in painting_items.keys():
+            if nsid in painting_items:
                 yield data, painting_items[nsid], commons_data.get(nsid)
         else:
             pywikibot.output(u'You are done!')
@@ -370,6 +674,9 @@ def main(*args):
     """Run the bot from the command line and handle any arguments."""
     # handle arguments
     rows = None
+    batch_size = None
+    dry_run = False
+    convert_lido = False
 
     for arg in pywikibot.handle_args(args):
         option, sep, value = arg.partition(':')
@@ -378,12 +685,32 @@ def main(*args):
                 rows = int(value)
             else:
                 raise pywikibot.Error(usage)
+        elif option == '-batch':
+            if not value:
+                batch_size = MAX_ENTITIES
+            elif helpers.is_pos_int(value):
+                batch_size = int(value)
+            else:
+                raise pywikibot.Error(usage)
+        elif option == '-dry_run':
+            dry_run = True
+        elif option == '-convert_lido':
+            convert_lido = True
+
+    if convert_lido:
+        processed_lido = u'NatMus-images/data/processed_lido.json'
+        num_entries = convert_to_json_lines(
+            processed_lido, path.splitext(processed_lido)[0] + u'.jsonl')
+        pywikibot.output(u'Converted %d LIDO entries' % num_entries)
+        return
 
     painting_items, lido_data, commons_data, people_items = prepare_data()
     painting_gen = get_painting_generator(
         lido_data, painting_items, commons_data, rows=rows)
 
     paintings_bot = PaintingsImageBot(painting_gen, people_items)
+    paintings_bot.batch_size = batch_size
+    paintings_bot.dry_run = dry_run
     paintings_bot.run()
     paintings_bot.log.close()
 
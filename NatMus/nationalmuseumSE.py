@@ -17,15 +17,31 @@ Can also handle any pywikibot options. Most importantly:
 -simulate         Don't write to database
 """
 import codecs
+import collections
+import gzip
 import json
+import os
+import re
+import sqlite3
+import sys
+import time
 import urllib2
+from multiprocessing.pool import ThreadPool
 
 import pywikibot
 from pywikibot import pagegenerators
-import pywikibot.data.wikidataquery as wdquery
 import wikidataStuff.helpers as helpers
+import wikidataStuff.wdqsLookup as wdqsLookup
 from wikidataStuff.WikidataStuff import WikidataStuff as WD
 
+try:
+    from batchtools import BatchEdit, IdentifierIndex, RateLimiter
+    from batchtools.preload import MAX_ENTITIES
+except ImportError:  # run from within its project directory
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from batchtools import BatchEdit, IdentifierIndex, RateLimiter
+    from batchtools.preload import MAX_ENTITIES
+
 import config as config
 
 usage = u"""
@@ -38,7 +54,36 @@ Usage:            python NatMus/nationalmuseumSE.py [OPTIONS]
 
 -cursor:str       The Europeana pagination cursor at which to start the search
 
--wdq_cache:INT    Set the cache age (in seconds) for wdq queries (default 0)
+-workers:INT      Number of concurrent Europeana record requests (default: 1)
+
+-rate:FLOAT       Max number of Europeana requests per second (default: no
+                  limit)
+
+-wdq_cache:INT    Set the cache age (in seconds) for wdq queries and the
+                  locally stored identifier indexes (default 0)
+
+-mirror[:PATH]    Also write each Europeana search page and record to a local
+                  mirror in this directory (default: europeana_mirror). If
+                  no -cursor is given an unfinished harvest is resumed,
+                  while a complete harvest is left as is and the bot stops.
+
+-offline          Read the Europeana records from the local mirror instead
+                  of from the API
+
+-index_creators   Build an index of Oku_NM_arbetskopia.json, which is then
+                  used in place of the full dump file, and exit. The index
+                  is rebuilt by later runs whenever the dump is newer.
+
+-bulk_commons     Find image candidates in a single harvest of all Commons
+                  files linking to the Nationalmuseum, instead of searching
+                  Commons for each painting. The harvest is stored and
+                  reused for as long as allowed by -wdq_cache.
+
+-batch_edits      Submit all new claims, references, labels and descriptions
+                  for a painting in a single edit
+
+-missed_creators  Write a top-list of the creators named in descriptions of
+                  paintings lacking a creator to creatorHitlist.csv, and exit
 """
 docuReplacements = {'&params;': usage}
 
@@ -51,6 +96,195 @@ ICON_Q = u'132137'
 ANON_Q = '4233718'
 MINIATURE_URL = u'http://partage.vocnet.org/part00814'
 MAX_ROWS = 100  # max number of rows per request in Europeana API
+MISSED_CREATOR_PREFIX = u'painting by '  # description naming the creator
+MIRROR_DIR = 'europeana_mirror'  # default directory of the local mirror
+CREATOR_DUMP = 'Oku_NM_arbetskopia.json'  # the Oku_NM creator dump
+CREATOR_INDEX = 'Oku_NM_arbetskopia.sqlite'  # indexed copy of the dump
+COMMONS_FILES = 'commons_files.json'  # object id to linking Commons files
+OBJECT_URL = re.compile(  # the object id in a nationalmuseum.se object url
+    r'collection\.nationalmuseum\.se/eMuseumPlus\?service=ExternalInterface'
+    r'&module=collection&objectId=([^&]+)&viewType=detailView')
+
+
+class EuropeanaMirror(object):
+    """A local copy of harvested Europeana search pages and records.
+
+    Search pages and full records are appended, as gzipped JSON lines, to
+    pages.jsonl.gz and records.jsonl.gz respectively. Each page is written
+    as a separate gzip member, after which a checkpoint holding the cursor
+    of the next page is stored, so that an interrupted harvest can be
+    resumed. Once the last page is stored the checkpoint is marked as
+    complete. When a record has been harvested several times the latest
+    copy is used.
+    """
+
+    PAGES_FILE = 'pages.jsonl.gz'
+    RECORDS_FILE = 'records.jsonl.gz'
+    CHECKPOINT_FILE = 'checkpoint.json'
+
+    def __init__(self, path):
+        """Initiate the mirror.
+
+        @param path: the directory holding the mirror
+        @type path: str
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def add_page(self, cursor, page, records, counter):
+        """Store a search page, its records and a checkpoint.
+
+        @param cursor: the cursor used to retrieve the page
+        @type cursor: str
+        @param page: the search result object
+        @type page: dict
+        @param records: the painting objects for the items on the page
+        @type records: list of dict
+        @param counter: the number of results handled before the next page
+        @type counter: int
+        """
+        with gzip.open(os.path.join(self.path, self.RECORDS_FILE), 'ab') as f:
+            for record in records:
+                f.write(json.dumps({
+                    'id': record['object']['about'],
+                    'data': record}) + '\n')
+        with gzip.open(os.path.join(self.path, self.PAGES_FILE), 'ab') as f:
+            f.write(json.dumps({'cursor': cursor, 'data': page}) + '\n')
+        with open(os.path.join(self.path, self.CHECKPOINT_FILE), 'w') as f:
+            json.dump({
+                'cursor': page.get('nextCursor'),
+                'counter': counter,
+                'complete': not page.get('nextCursor')}, f)
+
+    def load_checkpoint(self):
+        """Return the stored checkpoint.
+
+        @return: the checkpoint, empty if there is none
+        @rtype: dict
+        """
+        try:
+            with open(os.path.join(self.path, self.CHECKPOINT_FILE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get_checkpoint(self):
+        """Return the cursor at which to resume an unfinished harvest.
+
+        @return: the cursor, None if there is nothing to resume, and the
+            number of results handled before it
+        @rtype: (str or None, int)
+        """
+        checkpoint = self.load_checkpoint()
+        if not checkpoint or checkpoint.get('complete'):
+            return None, 0
+        return checkpoint['cursor'], checkpoint['counter']
+
+    def is_complete(self):
+        """Check whether the mirror holds a complete harvest.
+
+        @rtype: bool
+        """
+        return bool(self.load_checkpoint().get('complete'))
+
+    def read_records(self):
+        """Yield each stored id and record.
+
+        Reading stops, with a warning, at a partially written page.
+
+        @yield: (str, dict)
+        """
+        try:
+            with gzip.open(os.path.join(self.path, self.RECORDS_FILE)) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    yield entry['id'], entry['data']
+        except (IOError, EOFError, ValueError) as e:
+            if isinstance(e, IOError) and e.errno is not None:
+                raise  # e.g. a missing file
+            pywikibot.warning(u'Stopped reading the mirror at an incomplete '
+                              u'page: %s' % e)
+
+    def get_records(self, rows=None):
+        """Yield the latest copy of each stored record.
+
+        Records are yielded in the order in which their latest copy was
+        harvested. The mirror is read twice so as to avoid holding all of
+        the records in memory.
+
+        @param rows: the number of records to yield
+        @type rows: int
+        @yield: dict
+        """
+        latest = {}
+        for i, (record_id, record) in enumerate(self.read_records()):
+            latest[record_id] = i
+
+        count = 0
+        for i, (record_id, record) in enumerate(self.read_records()):
+            if rows and count >= rows:
+                return
+            if latest.get(record_id) == i:
+                count += 1
+                yield record
+
+
+class CreatorIndex(object):
+    """An SQLite index of the Oku_NM creator dump, keyed by object id.
+
+    Entries are only loaded when looked up, avoiding having to keep the
+    whole dump in memory. The index is built from the dump using
+    CreatorIndex.build().
+    """
+
+    def __init__(self, filename):
+        """Initiate the index.
+
+        @param filename: the index file
+        @type filename: str
+        """
+        self.db = sqlite3.connect(filename)
+
+    @staticmethod
+    def build(dump_file, filename):
+        """Build, or rebuild, the index from the creator dump.
+
+        @param dump_file: the Oku_NM creator dump
+        @type dump_file: str
+        @param filename: the index file
+        @type filename: str
+        @return: the number of indexed objects
+        @rtype: int
+        """
+        with open(dump_file) as f:
+            dump = json.load(f)
+        db = sqlite3.connect(filename)
+        with db:
+            db.execute('DROP TABLE IF EXISTS creators')
+            db.execute('CREATE TABLE creators '
+                       '(obj_id TEXT PRIMARY KEY, artists TEXT)')
+            db.executemany(
+                'INSERT INTO creators VALUES (?, ?)',
+                ((obj_id, json.dumps(artists))
+                 for obj_id, artists in dump.iteritems()))
+        db.close()
+        return len(dump)
+
+    def get(self, obj_id, default=None):
+        """Return the artists of an object, or the default if not present.
+
+        @param obj_id: the nationalmuseum database id
+        @type obj_id: str
+        @return: artist id to artist info
+        @rtype: dict
+        """
+        row = self.db.execute(
+            'SELECT artists FROM creators WHERE obj_id = ?',
+            (obj_id, )).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
 
 
 class PaintingsBot:
@@ -69,9 +303,12 @@ class PaintingsBot:
         self.generator = dict_generator
         self.repo = pywikibot.Site().data_repository()
         self.commons = pywikibot.Site(u'commons', u'commons')
+        self.commons_files = None  # object id to files, if found in bulk
         self.wd = WD(self.repo)
         self.add_new = False  # If new objects should be created
         self.skip_miniatures = True  # If (new) miniatures should be skipped
+        self.batch_edits = False  # If each painting is changed in one edit
+        self.batch = None  # BatchEdit for the current painting
 
         # Load prefixes and find allowed collections
         collections = set([INSTITUTION_Q])
@@ -87,9 +324,20 @@ class PaintingsBot:
         # Set log file
         self.log = codecs.open(u'nationalmuseumSE.log', 'a', 'utf-8')
 
-        # Load creator dump file
-        self.creator_dump = helpers.load_json_file('Oku_NM_arbetskopia.json',
-                                                   force_path=__file__)
+        # Load creator dump index, else the whole dump file
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        index_file = os.path.join(base_path, CREATOR_INDEX)
+        dump_file = os.path.join(base_path, CREATOR_DUMP)
+        if os.path.exists(index_file):
+            if os.path.exists(dump_file) and \
+                    os.path.getmtime(dump_file) > os.path.getmtime(index_file):
+                pywikibot.output(u'%s has been updated, rebuilding its index'
+                                 % CREATOR_DUMP)
+                CreatorIndex.build(dump_file, index_file)
+            self.creator_dump = CreatorIndex(index_file)
+        else:
+            self.creator_dump = helpers.load_json_file(CREATOR_DUMP,
+                                                       force_path=__file__)
 
         # hard-coded anons e.g. "unknown swedish 17th century"
         anons = helpers.load_json_file('anons.json', force_path=__file__)
@@ -97,13 +345,17 @@ class PaintingsBot:
         # prepare WDQ painting query
         query = u'CLAIM[195:%s] AND CLAIM[%s]' % \
                 (',195:'.join(self.collections), painting_id_prop)
-        self.painting_ids = helpers.fill_cache(painting_id_prop,
-                                               queryoverride=query,
-                                               cache_max_age=cache_max_age)
+        self.painting_ids = IdentifierIndex(
+            query,
+            lambda: helpers.fill_cache(painting_id_prop,
+                                       queryoverride=query),
+            cache_max_age)
 
         # prepare WDQ artist query (nat_mus_id - Q_id pairs)
-        self.artist_ids = helpers.fill_cache('P2538',
-                                             cache_max_age=cache_max_age)
+        self.artist_ids = IdentifierIndex(
+            'P2538',
+            lambda: helpers.fill_cache('P2538'),
+            cache_max_age)
         # add anons
         for a in anons:
             self.artist_ids[a] = ANON_Q
@@ -148,6 +400,7 @@ class PaintingsBot:
                         painting['object']['about']
 
         painting_item = None
+        self.batch = None
         # newclaims = []
         if painting_id in self.painting_ids:
             painting_item = self.create_existing_painting(painting,
@@ -163,6 +416,8 @@ class PaintingsBot:
         if painting_item and painting_item.exists():
             data = painting_item.get(force=True)
             claims = data.get('claims')
+            if self.batch_edits and not self.batch:
+                self.batch = BatchEdit(self.wd, painting_item, EDIT_SUMMARY)
 
             # add natmus id claim
             self.add_natmus_id(painting_item, obj_id, uri)
@@ -194,6 +449,27 @@ class PaintingsBot:
             # if u'P170' not in claims:
             #    self.add_dbpedia_creator(painting_item, painting)
 
+            if self.batch:
+                self.batch.submit()
+                self.batch = None
+
+    def add_claim(self, prop, statement, item, ref):
+        """Add a claim (if new) and source it, or queue it if batching.
+
+        @param prop: the property of the claim
+        @type prop: str
+        @param statement: the statement to add
+        @type statement: WD.Statement
+        @param item: item to which claim is added
+        @type item: pywikibot.ItemPage
+        @param ref: the reference to add
+        @type ref: WD.Reference
+        """
+        if self.batch:
+            self.batch.add_claim(prop, statement, ref)
+        else:
+            self.wd.addNewClaim(prop, statement, item, ref)
+
     def add_title_claim(self, painting_item, painting):
         """Add a title/P1476 claim based on dcTitle.
 
@@ -207,7 +483,7 @@ class PaintingsBot:
         for lang, title in dc_title.iteritems():
             titles.append(pywikibot.WbMonolingualText(title[0], lang))
         for title in titles:
-            self.wd.addNewClaim(
+            self.add_claim(
                 u'P1476',
                 WD.Statement(title),
                 painting_item,
@@ -228,7 +504,7 @@ class PaintingsBot:
         """
         place = self.prefix_map[painting_id.split(' ')[0]]['place']
         place_item = self.wd.QtoItemPage(place)
-        self.wd.addNewClaim(
+        self.add_claim(
             u'P276',
             WD.Statement(place_item),
             painting_item,
@@ -280,7 +556,7 @@ class PaintingsBot:
             for image in images:
                 pywikibot.output(u'\t%s' % image)
         elif len(images) == 1:
-            self.wd.addNewClaim(
+            self.add_claim(
                 u'P18',
                 WD.Statement(images[0]),
                 painting_item,
@@ -305,7 +581,7 @@ class PaintingsBot:
                              (painting_item, europeana_prop, europeana_id))
             return
 
-        self.wd.addNewClaim(
+        self.add_claim(
             europeana_prop,
             WD.Statement(europeana_id),
             painting_item,
@@ -329,7 +605,7 @@ class PaintingsBot:
         if painting_id.split(' ')[0] == 'NMI':
             dcformat_item = self.wd.QtoItemPage(ICON_Q)  # icon
 
-        self.wd.addNewClaim(
+        self.add_claim(
             u'P31',
             WD.Statement(dcformat_item),
             painting_item,
@@ -364,6 +640,8 @@ class PaintingsBot:
         @rtype: pywikibot.ItemPage
         """
         painting_item = self.wd.QtoItemPage(self.painting_ids.get(painting_id))
+        if self.batch_edits:
+            self.batch = BatchEdit(self.wd, painting_item, EDIT_SUMMARY)
 
         # check label
         data = painting_item.get()
@@ -372,7 +650,11 @@ class PaintingsBot:
         if new_labels:
             pywikibot.output('Adding label to %s' %
                              painting_item.title())
-            painting_item.editLabels(new_labels)
+            if self.batch:
+                for lang, label in new_labels.iteritems():
+                    self.batch.add_label(lang, label)
+            else:
+                painting_item.editLabels(new_labels)
 
         # check description
         descriptions = make_descriptions(painting)
@@ -381,7 +663,11 @@ class PaintingsBot:
             if new_descr:
                 pywikibot.output('Adding description to %s' %
                                  painting_item.title())
-                painting_item.editDescriptions(new_descr)
+                if self.batch:
+                    for lang, description in new_descr.iteritems():
+                        self.batch.add_description(lang, description)
+                else:
+                    painting_item.editDescriptions(new_descr)
 
         return painting_item
 
@@ -447,7 +733,7 @@ class PaintingsBot:
         @param uri: reference url on nationalmuseum.se
         @type uri: str
         """
-        self.wd.addNewClaim(
+        self.add_claim(
             u'P2539',
             WD.Statement(obj_id),
             painting_item,
@@ -463,17 +749,17 @@ class PaintingsBot:
         @param uri: reference url on nationalmuseum.se
         @type uri: str
         """
-        if obj_id not in self.creator_dump.keys():
+        dump_entry = self.creator_dump.get(obj_id)
+        if dump_entry is None:
             return
 
         # each artwork may have multiple artists,
         # which must all be on wikidata
-        for artist_id in self.creator_dump[obj_id].keys():
-            if artist_id not in self.artist_ids.keys():
+        for artist_id in dump_entry:
+            if artist_id not in self.artist_ids:
                 self.logger('Artist not found on wikidata: %s' % artist_id)
                 return
 
-        dump_entry = self.creator_dump[obj_id]
         if len(dump_entry) == 1:
             artist_entry = dump_entry.iteritems().next()
             self.add_singel_natmus_creator(painting_item, artist_entry, uri)
@@ -634,7 +920,7 @@ class PaintingsBot:
                     itis=related_info['itis']))
 
         # set claim
-        self.wd.addNewClaim(
+        self.add_claim(
             u'P170',
             creator_statement,
             target_item,
@@ -670,7 +956,7 @@ class PaintingsBot:
             return
 
         # add inventory number with collection
-        self.wd.addNewClaim(
+        self.add_claim(
             self.painting_id_prop,
             WD.Statement(painting_id).addQualifier(
                 WD.Qualifier(
@@ -686,7 +972,7 @@ class PaintingsBot:
         if subcol is not None:
             collection_item = self.wd.QtoItemPage(subcol)
 
-        self.wd.addNewClaim(
+        self.add_claim(
             collection_p,
             WD.Statement(collection_item),
             painting_item,
@@ -734,6 +1020,14 @@ class PaintingsBot:
         @return: matching images
         @rtype: list
         """
+        if self.commons_files is not None:
+            match = OBJECT_URL.search(uri)
+            titles = []
+            if match:
+                titles = self.commons_files.get(match.group(1), [])
+            return [pywikibot.FilePage(self.commons, title)
+                    for title in titles]
+
         images = []
         uri = uri.split('://')[1]
         objgen = pagegenerators.LinksearchPageGenerator(uri, namespaces=[6],
@@ -746,48 +1040,150 @@ class PaintingsBot:
 
         return images
 
-    def most_missed_creators(self, cache_max_age=0):
-        """Produce list of most frequent, but unlinked, creators.
+    def load_commons_files(self, cache_max_age=0):
+        """Load the index of Commons files linking to Nationalmuseum objects.
 
-        Query WDQ for all objects in the collection missing an artist
-        then put together a top-list for most desired creator
+        Once loaded, file_from_external_link() uses the index instead of
+        searching Commons. The index is harvested anew if the stored one is
+        older than cache_max_age.
+
+        @param cache_max_age: Max age of the stored index, defaults to 0
+        @type cache_max_age: int
         """
-        expected_items = []
-        query = u'CLAIM[195:%s] AND NOCLAIM[170]' % \
-                ',195:'.join(self.collections)  # collection
-        wd_queryset = wdquery.QuerySet(query)
+        filename = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), COMMONS_FILES)
+        try:
+            with open(filename) as f:
+                stored = json.load(f)
+            if time.time() - stored['retrieved'] < cache_max_age:
+                self.commons_files = stored['files']
+                return
+        except (IOError, ValueError):
+            pass
 
-        wd_query = wdquery.WikidataQuery(cacheMaxAge=cache_max_age)
-        data = wd_query.query(wd_queryset)
+        self.commons_files = self.harvest_commons_files()
+        with open(filename, 'w') as f:
+            json.dump({
+                'retrieved': time.time(),
+                'files': self.commons_files}, f)
 
-        if data.get('status').get('error') == 'OK':
-            expected_items = data.get('items')
+    def harvest_commons_files(self):
+        """Find all files on Commons linking to a Nationalmuseum object.
+
+        @return: object id to the titles of the linking files
+        @rtype: dict
+        """
+        files = {}
+        for protocol in ('http', 'https'):
+            gen = pywikibot.data.api.ListGenerator(
+                'exturlusage', site=self.commons, parameters={
+                    'euquery': u'collection.nationalmuseum.se/eMuseumPlus',
+                    'euprotocol': protocol,
+                    'eunamespace': 6,
+                    'euprop': 'title|url'})
+            for result in gen:
+                match = OBJECT_URL.search(result['url'])
+                if match:
+                    files.setdefault(match.group(1), set()).add(
+                        result['title'])
+        pywikibot.output(u'Found Commons files for %d objects' % len(files))
+        return dict((obj_id, sorted(titles))
+                    for obj_id, titles in files.iteritems())
+
+    def most_missed_creators(self, workers=1):
+        """Produce list of most frequent, but unlinked, creators.
+
+        Count the creators named in the English descriptions of all objects
+        in the collection which are missing an artist, then put together a
+        top-list for most desired creator. The counting is done in a single
+        aggregate SPARQL query. Should that fail the objects are instead
+        fetched in batches, concurrently if there are several workers.
+
+        @param workers: the number of concurrent batch requests in the
+            fallback
+        @type workers: int
+        """
+        try:
+            hits = self.count_missed_creators()
+        except pywikibot.Error as e:
+            pywikibot.output(u'Aggregate query failed, fetching objects '
+                             u'instead: %s' % e)
+            hits = None
+        if hits is None:
+            hits = self.fetch_missed_creators(workers)
 
-        creator_dict = {}
         counter = 0
-        for q_val in expected_items:
-            q_item = self.wd.QtoItemPage(q_val)
-            data = q_item.get()
-            claims = data.get('claims')
-            if u'P170' in claims:
-                continue
-            descr = data.get('descriptions').get('en')
-            if descr and descr.startswith(u'painting by '):
-                creator = descr[len(u'painting by '):]
-                if '(' in creator:  # to get rid of disambiguation addition
-                    creator = creator[:creator.find('(')].strip()
-                if creator in creator_dict.keys():
-                    creator_dict[creator] += 1
-                else:
-                    creator_dict[creator] = 1
-                counter += 1
+        with codecs.open(u'creatorHitlist.csv', 'w', 'utf-8') as f:
+            for creator, count in hits:
+                f.write(u'%d|%s\n' % (count, creator))
+                counter += count
         pywikibot.output(u'Found %d mentions of %d creators' %
-                         (counter, len(creator_dict)))
-        # output
-        f = codecs.open(u'creatorHitlist.csv', 'w', 'utf-8')
-        for k, v in creator_dict.iteritems():
-            f.write(u'%d|%s\n' % (v, k))
-        f.close()
+                         (counter, len(hits)))
+
+    def count_missed_creators(self):
+        """Count the unlinked creators in one aggregate SPARQL query.
+
+        @return: (creator, count) pairs, most frequent first, or None if
+            the query gave no result
+        @rtype: list of tuples
+        """
+        query = (
+            u'SELECT ?creator (COUNT(DISTINCT ?item) AS ?count) WHERE { '
+            u'VALUES ?collection { %s } '
+            u'?item wdt:P195 ?collection . '
+            u'FILTER NOT EXISTS { ?item wdt:P170 [] } '
+            u'?item schema:description ?descr . '
+            u'FILTER(LANG(?descr) = "en" && '
+            u'STRSTARTS(?descr, "%s")) '
+            u'BIND(REPLACE(STRAFTER(?descr, "%s"), " *[(].*$", "") '
+            u'AS ?creator) } '
+            u'GROUP BY ?creator ORDER BY DESC(?count) ?creator' % (
+                u' '.join(u'wd:Q%s' % q for q in self.collections),
+                MISSED_CREATOR_PREFIX, MISSED_CREATOR_PREFIX))
+        data = wdqsLookup.make_simple_wdqs_query(query)
+        if data is None:
+            return None
+        return [(result['creator'], int(result['count'])) for result in data]
+
+    def fetch_missed_creators(self, workers=1):
+        """Count the unlinked creators by fetching the objects in batches.
+
+        @param workers: the number of concurrent batch requests
+        @type workers: int
+        @return: (creator, count) pairs, most frequent first
+        @rtype: list of tuples
+        """
+        query = u'CLAIM[195:%s] AND NOCLAIM[170]' % \
+                ',195:'.join(self.collections)  # collection
+        q_ids = [u'Q%s' % q for q in wdqsLookup.wdq_to_wdqs(query)]
+        batches = [q_ids[i:i + MAX_ENTITIES]
+                   for i in range(0, len(q_ids), MAX_ENTITIES)]
+
+        def count_batch(batch):
+            request = pywikibot.data.api.Request(
+                site=self.repo, parameters={
+                    'action': 'wbgetentities',
+                    'ids': u'|'.join(batch),
+                    'props': 'claims|descriptions',
+                    'languages': 'en'})
+            creators = collections.Counter()
+            for entity in request.submit()['entities'].values():
+                if u'P170' in entity.get('claims', {}):
+                    continue
+                descr = entity.get('descriptions', {}).get('en', {})
+                creator = creator_from_description(descr.get('value'))
+                if creator:
+                    creators[creator] += 1
+            return creators
+
+        creator_dict = collections.Counter()
+        pool = ThreadPool(max(workers, 1))
+        try:
+            for creators in pool.imap_unordered(count_batch, batches):
+                creator_dict.update(creators)
+        finally:
+            pool.terminate()
+        return sorted(creator_dict.items(), key=lambda x: (-x[1], x[0]))
 
     def logger(self, text):
         """Append text to logfile.
@@ -799,6 +1195,22 @@ class PaintingsBot:
         self.log.flush()  # because shit tends to crash
 
 
+def creator_from_description(descr):
+    """Extract the creator named in an English painting description.
+
+    @param descr: the English description
+    @type descr: str|None
+    @return: the creator without any disambiguation, or None
+    @rtype: str|None
+    """
+    if not descr or not descr.startswith(MISSED_CREATOR_PREFIX):
+        return None
+    creator = descr[len(MISSED_CREATOR_PREFIX):]
+    if '(' in creator:  # to get rid of disambiguation addition
+        creator = creator[:creator.find('(')]
+    return creator.strip()
+
+
 def make_descriptions(painting):
     """Given a painting object construct descriptions in en/nl/sv.
 
@@ -897,46 +1309,79 @@ def find_new_values(data, values, key):
     return new_values
 
 
-def get_painting_generator(rows=None, cursor=None, counter=0):
+def get_painting_generator(rows=None, cursor=None, counter=0, workers=1,
+                           rate=None, mirror=None):
     """Get objects from Europeana's API.
 
-    @todo: this ends up having loads of instances of the function running
-           a while loop (or other solution, could mitigate that)
+    The next page of search results is requested in the background while
+    the paintings on the current page are retrieved, concurrently if there
+    are several workers. Paintings are yielded in search result order.
 
     @param rows: the number of results to request
     @type rows: int
     @param cursor: the cursor for the next paginated response
     @type cursor: str
+    @param counter: the number of results already handled
+    @type counter: int
+    @param workers: the number of concurrent painting requests
+    @type workers: int
+    @param rate: max number of requests per second, None for no limit
+    @type rate: float
+    @param mirror: local mirror to which pages and records are also written
+    @type mirror: EuropeanaMirror
     @yield: dict
     """
     cursor = cursor or '*'  # initial value for cursor
-    num_rows = rows or MAX_ROWS  # to separate the None case
-
-    # perform search
-    overview_json_data = get_search_results(min(MAX_ROWS, num_rows),
-                                            cursor)
-    cursor = overview_json_data.get('nextCursor')  # None if at the end
-
-    # get data for each individual item in the search batch
-    # the last batch is not guaranteed to contain any items
-    if overview_json_data.get('items'):
-        for item in overview_json_data.get('items'):
-            yield get_single_painting(item)
-
-    # call again to get next set of results if there is a new pagination cursor
-    if cursor:
-        if not rows or num_rows > MAX_ROWS:
-            counter += MAX_ROWS
-            pywikibot.output(u'%d... %s' % (counter, cursor))
-            rows = min(rows, num_rows - MAX_ROWS)  # preserves None
-            for g in get_painting_generator(rows=rows,
-                                            cursor=cursor,
-                                            counter=counter):
-                yield g
-        else:
-            pywikibot.output(u'You are done!')
-    else:
-        pywikibot.output(u'No more results! You are done!')
+    limiter = RateLimiter(rate)
+
+    def search(num_rows, cursor):
+        limiter.wait()
+        return get_search_results(min(MAX_ROWS, num_rows), cursor)
+
+    def single_painting(item):
+        limiter.wait()
+        return get_single_painting(item)
+
+    # a separate thread so that the next search never waits for the paintings
+    search_pool = ThreadPool(1)
+    pool = ThreadPool(max(workers, 1))
+    try:
+        page = search_pool.apply_async(search, (rows or MAX_ROWS, cursor))
+        while page:
+            overview_json_data = page.get()
+            page_cursor = cursor
+            cursor = overview_json_data.get('nextCursor')  # None if at the end
+
+            # prefetch the next set of results if there is a new cursor
+            page = None
+            if cursor and (not rows or rows > MAX_ROWS):
+                if rows:
+                    rows -= MAX_ROWS
+                page = search_pool.apply_async(
+                    search, (rows or MAX_ROWS, cursor))
+
+            # get data for each individual item in the search batch
+            # the last batch is not guaranteed to contain any items
+            items = overview_json_data.get('items') or []
+            paintings = []
+            for painting in pool.imap(single_painting, items):
+                if mirror:
+                    paintings.append(painting)
+                yield painting
+
+            if mirror:
+                mirror.add_page(page_cursor, overview_json_data, paintings,
+                                counter + MAX_ROWS)
+            if page:
+                counter += MAX_ROWS
+                pywikibot.output(u'%d... %s' % (counter, cursor))
+            elif cursor:
+                pywikibot.output(u'You are done!')
+            else:
+                pywikibot.output(u'No more results! You are done!')
+    finally:
+        search_pool.terminate()
+        pool.terminate()
 
 
 def get_search_results(rows, cursor):
@@ -1012,6 +1457,14 @@ def main(*args):
     add_new = True
     cursor = None
     cache_max_age = 0
+    batch_edits = False
+    workers = 1
+    rate = None
+    mirror = None
+    offline = False
+    index_creators = False
+    bulk_commons = False
+    missed_creators = False
 
     for arg in pywikibot.handle_args(args):
         option, sep, value = arg.partition(':')
@@ -1029,15 +1482,68 @@ def main(*args):
                 raise pywikibot.Error(usage)
         elif option == '-cursor':
             cursor = value
+        elif option == '-workers':
+            if helpers.is_pos_int(value):
+                workers = int(value)
+            else:
+                raise pywikibot.Error(usage)
+        elif option == '-rate':
+            rate = float(value)
+        elif option == '-mirror':
+            mirror = value or MIRROR_DIR
+        elif option == '-offline':
+            offline = True
+        elif option == '-index_creators':
+            index_creators = True
+        elif option == '-bulk_commons':
+            bulk_commons = True
         elif option == '-wdq_cache':
             cache_max_age = int(value)
+        elif option == '-batch_edits':
+            batch_edits = True
+        elif option == '-missed_creators':
+            missed_creators = True
+
+    if index_creators:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        num_objects = CreatorIndex.build(
+            os.path.join(base_path, CREATOR_DUMP),
+            os.path.join(base_path, CREATOR_INDEX))
+        pywikibot.output(u'Indexed the creators of %d objects' % num_objects)
+        return
 
-    painting_gen = get_painting_generator(rows=rows, cursor=cursor)
+    if offline:
+        painting_gen = EuropeanaMirror(mirror or MIRROR_DIR).get_records(rows)
+    elif mirror:
+        mirror = EuropeanaMirror(mirror)
+        counter = 0
+        if not cursor:
+            if mirror.is_complete():
+                pywikibot.output(
+                    u'%s already holds a complete harvest. Use -offline to '
+                    u'process it, or remove it to harvest anew.' %
+                    mirror.path)
+                return
+            cursor, counter = mirror.get_checkpoint()
+            if cursor:
+                pywikibot.output(u'Resuming harvest at %d... %s' %
+                                 (counter, cursor))
+        painting_gen = get_painting_generator(
+            rows=rows, cursor=cursor, counter=counter, workers=workers,
+            rate=rate, mirror=mirror)
+    else:
+        painting_gen = get_painting_generator(rows=rows, cursor=cursor,
+                                              workers=workers, rate=rate)
 
     paintings_bot = PaintingsBot(painting_gen, INVNO_P, cache_max_age)
     paintings_bot.add_new = add_new
+    paintings_bot.batch_edits = batch_edits
+    if missed_creators:
+        paintings_bot.most_missed_creators(workers)
+        return
+    if bulk_commons:
+        paintings_bot.load_commons_files(cache_max_age)
     paintings_bot.run()
-    # paintings_bot.most_missed_creators()
 
 
 if __name__ == "__main__":
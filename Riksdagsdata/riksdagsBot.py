@@ -15,6 +15,8 @@ Options (may be omitted):
   -cutoff:INT       number of entries to process before terminating
   -delay:INT        seconds to delay between each riksdag request
                     (default 0)
+  -wdq_cache:INT    set the cache age (in seconds) for the local index of
+                    riksdag ids (default 0)
 
 TODO: note that comparisons need to be done so that it works for
       e.g. Q2740012 i.e. compare only on value (+ any qualifiers
@@ -24,10 +26,19 @@ TODO: note that comparisons need to be done so that it works for
 See https://github.com/lokal-profil/wikidata-stuff/issues for TODOs
 """
 # import json
+import os
+import sys
+
 import pywikibot
 import wikidataStuff.helpers as helpers
 from wikidataStuff.WikidataStuff import WikidataStuff as WD
 
+try:
+    from batchtools import IdentifierIndex
+except ImportError:  # run from within its project directory
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from batchtools import IdentifierIndex
+
 STATED_IN_P = 'P248'
 RIKSDAG_ID_P = 'P1214'
 ORDINAL_P = 'P1545'
@@ -51,11 +62,13 @@ class RiksdagsBot(object):
         u'firstName': {}}
     current_id = ''  # for debugging
 
-    def __init__(self, dictGenerator, verbose=False):
+    def __init__(self, dictGenerator, verbose=False, cache_max_age=0):
         """Instantiate a RiksdagsBot object.
 
         param dictGenerator: A generator that yields Dict objects.
         param verbose: If Bot should operate in Verbose mode, default=False
+        param cache_max_age: Max age (in seconds) of the local wdq cache and
+            identifier index, default=0
         """
         self.generator = dictGenerator
         self.repo = pywikibot.Site().data_repository()
@@ -66,8 +79,11 @@ class RiksdagsBot(object):
         self.mappings = helpers.load_json_file('mappings.json',
                                                force_path=__file__)
 
-        # trigger wdq query
-        self.itemIds = helpers.fill_cache(RIKSDAG_ID_P)
+        # load the riksdag id index, triggering a wdq query if outdated
+        self.itemIds = IdentifierIndex(
+            RIKSDAG_ID_P,
+            lambda: helpers.fill_cache(RIKSDAG_ID_P),
+            cache_max_age)
 
         # set up WikidataStuff object
         self.wd = WD(self.repo)
@@ -425,5 +441,10 @@ class RiksdagsBot(object):
 
 if __name__ == "__main__":
     # Only valid during testing
-    rB = RiksdagsBot(None, verbose=True)
+    cache_max_age = 0
+    for arg in pywikibot.handle_args():
+        option, sep, value = arg.partition(':')
+        if option == '-wdq_cache':
+            cache_max_age = int(value)
+    rB = RiksdagsBot(None, verbose=True, cache_max_age=cache_max_age)
     rB.testRun()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Tools shared by the batch uploads for making their Wikidata edits."""
+from batchtools.batch_edit import BatchEdit
+from batchtools.edit_item import edit_item
+from batchtools.identifier_index import IdentifierIndex
+from batchtools.preload import preload_items
+from batchtools.query_cache import load_query_results
+from batchtools.rate_limiter import RateLimiter
+
+__all__ = ['BatchEdit', 'IdentifierIndex', 'RateLimiter', 'edit_item',
+           'load_query_results', 'preload_items']
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""Batched edits, submitting all changes to an item in a single edit."""
+import collections
+
+import pywikibot
+
+
+class BatchEdit(object):
+    """
+    Changes to a single item, submitted together in one edit.
+
+    Statements, labels, aliases and descriptions are collected and only
+    compared to the item when the edit is submitted. New claims, new
+    references on identical claims and new labels, aliases and descriptions
+    are all sent in a single wbeditentity call. Statements needing more
+    care (a claim with the same property but a different value or
+    different qualifiers, a special or forced statement) are instead
+    handed to addNewClaim() afterwards.
+    """
+
+    def __init__(self, wd, item, summary=None):
+        """
+        Initialise the batch.
+
+        :param wd: the WikidataStuff instance used for any remaining edits
+        :param item: the item to edit
+        :param summary: the edit summary to use
+        """
+        self.wd = wd
+        self.item = item
+        self.summary = summary
+        self.statements = []  # (prop, Statement, Reference|None)
+        self.labels = {}  # lang to label
+        self.names = []  # (lang, name, case_sensitive)
+        self.descriptions = {}  # lang to description
+
+    def add_claim(self, prop, statement, ref):
+        """
+        Queue a claim to be added (if new) and sourced.
+
+        :param prop: the property of the claim
+        :param statement: the Statement to add
+        :param ref: the Reference (or None) to add
+        """
+        self.statements.append((prop, statement, ref))
+
+    def add_label(self, lang, label):
+        """
+        Queue a label to be added, unless one is already present.
+
+        :param lang: the language code
+        :param label: the label to add
+        """
+        self.labels.setdefault(lang, label)
+
+    def add_label_or_alias(self, lang, name, case_sensitive=False):
+        """
+        Queue a name as either a label (if none already) or an alias.
+
+        :param lang: the language code
+        :param name: the name to add
+        :param case_sensitive: whether the comparison is case sensitive
+        """
+        self.names.append((lang, name, case_sensitive))
+
+    def add_description(self, lang, description):
+        """
+        Queue a description to be added, unless one is already present.
+
+        :param lang: the language code
+        :param description: the description to add
+        """
+        self.descriptions.setdefault(lang, description)
+
+    def submit(self):
+        """
+        Submit the queued changes followed by any remaining statements.
+
+        If the item was edited by someone else in the meantime it is
+        reloaded and the changes are compared against it once more.
+
+        Statements handed on to addNewClaim() may turn out to be present
+        already, so these only count as an edit if the revision of the item
+        changed.
+
+        :return: bool whether the item was edited
+        """
+        try:
+            data, remaining = self.make_data()
+            if data:
+                self.item.editEntity(data, summary=self.summary)
+        except pywikibot.data.api.APIError as e:
+            if e.code != 'editconflict':
+                raise
+            pywikibot.output(
+                'Edit conflict on {}, reloading'.format(self.item.title()))
+            self.item.get(force=True)
+            data, remaining = self.make_data()
+            if data:
+                self.item.editEntity(data, summary=self.summary)
+
+        if data and remaining:
+            # make addNewClaim() aware of the submitted changes
+            self.item.get(force=True)
+        revision = self.item.latest_revision_id
+        for prop, statement, ref in remaining:
+            self.wd.addNewClaim(prop, statement, self.item, ref)
+
+        self.statements = []
+        self.labels = {}
+        self.names = []
+        self.descriptions = {}
+        return bool(data) or self.item.latest_revision_id != revision
+
+    def make_data(self):
+        """
+        Compare the queued changes to the item.
+
+        :return: (dict, list) the wbeditentity data for the new changes and
+            the statements which could not be included in it.
+        """
+        data = {}
+        claims, remaining = self.make_claims()
+        if claims:
+            data['claims'] = [claim.toJSON() for claim in claims]
+
+        labels, aliases = self.make_names()
+        if labels:
+            data['labels'] = dict(
+                (lang, {'language': lang, 'value': name})
+                for lang, name in labels.items())
+        if aliases:
+            data['aliases'] = dict(
+                (lang, [{'language': lang, 'value': name, 'add': ''}
+                        for name in names])
+                for lang, names in aliases.items())
+
+        descriptions = dict(
+            (lang, {'language': lang, 'value': description})
+            for lang, description in self.descriptions.items()
+            if lang not in self.item.descriptions)
+        if descriptions:
+            data['descriptions'] = descriptions
+
+        return data, remaining
+
+    def make_claims(self):
+        """
+        Determine the new and the newly sourced claims.
+
+        :return: (list, list) the pywikibot.Claims to submit and the
+            statements which could not be included among them.
+        """
+        claims = []
+        new_claims = {}  # prop to list of new pywikibot.Claims
+        edited = {}  # claim id to an edited copy of an existing claim
+        remaining = []
+        for prop, statement, ref in self.statements:
+            if statement.special or statement.force:
+                remaining.append((prop, statement, ref))
+                continue
+
+            existing = self.item.claims.get(prop, [])
+            candidates = [edited.get(c.snak, c) for c in existing] + \
+                new_claims.get(prop, [])
+            matches = [c for c in candidates
+                       if BatchEdit.is_same_statement(c, statement)]
+            if matches:
+                claim = matches[0]
+                if ref and not BatchEdit.has_ref(claim, ref):
+                    if claim.snak and claim.snak not in edited:
+                        # edit a copy so that the item is left untouched
+                        claim = pywikibot.Claim.fromJSON(
+                            self.wd.repo, claim.toJSON())
+                        edited[claim.snak] = claim
+                        claims.append(claim)
+                    claim.sources.append(self.make_source(ref))
+            elif not existing and not any(
+                    c.target_equals(statement.itis) for c in candidates):
+                claim = self.make_claim(prop, statement)
+                if ref:
+                    claim.sources.append(self.make_source(ref))
+                new_claims.setdefault(prop, []).append(claim)
+                claims.append(claim)
+            else:
+                remaining.append((prop, statement, ref))
+        return claims, remaining
+
+    def make_names(self):
+        """
+        Determine the new labels and aliases.
+
+        A queued label is only added if the item has no label in that
+        language, a queued name is otherwise added as an alias.
+
+        :return: (dict, dict) the new label per language and the list of
+            new aliases per language.
+        """
+        labels = {}
+        aliases = {}
+        known_labels = dict(self.item.labels)
+        known_aliases = dict((lang, list(names))
+                             for lang, names in self.item.aliases.items())
+        for lang, label in self.labels.items():
+            if lang not in known_labels:
+                known_labels[lang] = labels[lang] = label
+
+        for lang, name, case_sensitive in self.names:
+            if lang not in known_labels:
+                known_labels[lang] = labels[lang] = name
+                continue
+
+            known = [known_labels[lang]] + known_aliases.get(lang, [])
+            test = name
+            if not case_sensitive:
+                known = [k.lower() for k in known]
+                test = name.lower()
+            if test not in known:
+                known_aliases.setdefault(lang, []).append(name)
+                aliases.setdefault(lang, []).append(name)
+        return labels, aliases
+
+    def make_claim(self, prop, statement):
+        """
+        Make a new pywikibot.Claim, with qualifiers, from a statement.
+
+        :param prop: the property of the claim
+        :param statement: the Statement to convert
+        :return: pywikibot.Claim
+        """
+        claim = pywikibot.Claim(self.wd.repo, prop)
+        claim.setTarget(statement.itis)
+        for qual in statement.quals:
+            claim.qualifiers.setdefault(qual.prop, []).append(
+                self.make_snak(qual.prop, qual.itis, is_qualifier=True))
+        return claim
+
+    def make_source(self, ref):
+        """
+        Make a source, as found in pywikibot.Claim.sources, from a reference.
+
+        :param ref: the Reference to convert
+        :return: OrderedDict of property to list of snaks
+        """
+        source = collections.OrderedDict()
+        for claim in ref.get_all_sources():
+            source.setdefault(claim.getID(), []).append(
+                self.make_snak(claim.getID(), claim.getTarget(),
+                               is_reference=True))
+        return source
+
+    def make_snak(self, prop, target, is_qualifier=False, is_reference=False):
+        """
+        Make a qualifier or reference snak.
+
+        :param prop: the property of the snak
+        :param target: the value of the snak
+        :param is_qualifier: whether the snak is a qualifier
+        :param is_reference: whether the snak is part of a reference
+        :return: pywikibot.Claim
+        """
+        snak = pywikibot.Claim(self.wd.repo, prop, isQualifier=is_qualifier,
+                               isReference=is_reference)
+        snak.setTarget(target)
+        return snak
+
+    @staticmethod
+    def is_same_statement(claim, statement):
+        """
+        Check if a claim has the value and exact qualifiers of a statement.
+
+        :param claim: the claim to test
+        :param statement: the Statement to compare to
+        :return: bool
+        """
+        if not claim.target_equals(statement.itis):
+            return False
+        num_quals = sum(len(quals) for quals in claim.qualifiers.values())
+        if num_quals != len(statement.quals):
+            return False
+        return all(
+            any(q.target_equals(qual.itis)
+                for q in claim.qualifiers.get(qual.prop, []))
+            for qual in statement.quals)
+
+    @staticmethod
+    def has_ref(claim, ref):
+        """
+        Check if a claim is already sourced by a reference.
+
+        Only the tested part of the reference is compared, if there is one.
+
+        :param claim: the claim to test
+        :param ref: the Reference to look for
+        :return: bool
+        """
+        tests = ref.source_test or ref.get_all_sources()
+        for source in claim.sources:
+            if all(any(s.target_equals(test.getTarget())
+                       for s in source.get(test.getID(), []))
+                   for test in tests):
+                return True
+        return False
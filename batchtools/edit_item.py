@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Single edits to an item, retried on an edit conflict."""
+import pywikibot
+
+
+def edit_item(item, edit):
+    """
+    Make an edit to an item, reloading the item only on an edit conflict.
+
+    pywikibot updates the local copy of the item after each added claim,
+    qualifier or source, so later edits are aware of earlier ones without
+    having to download the entity again. If someone else edited the item
+    in the meantime the item is reloaded in place and the edit is retried
+    once.
+
+    :param item: the pywikibot.ItemPage to edit
+    :param edit: function making the edit given the item
+    """
+    try:
+        edit(item)
+    except pywikibot.data.api.APIError as e:
+        if e.code != 'editconflict':
+            raise
+        pywikibot.output(
+            'Edit conflict on {}, reloading'.format(item.title()))
+        item.get(force=True)
+        edit(item)
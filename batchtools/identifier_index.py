@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""A locally stored map of identifier values to Q-numbers."""
+import hashlib
+import os.path as path
+import sqlite3
+import threading
+import time
+
+DEFAULT_FILE = path.join(
+    path.dirname(path.dirname(path.abspath(__file__))), 'identifiers.sqlite')
+
+
+class IdentifierIndex(object):
+    """
+    A locally stored map of identifier values to Q-numbers for a property.
+
+    The map is kept in an SQLite database and behaves as a read-only dict,
+    without having to be loaded into memory. The stored map is used for as
+    long as it is younger than max_age, after which the provided fill
+    function is called. This is the only cache involved, the fill function
+    should therefore always return fresh data. The stored map is only
+    rewritten if the returned map differs from it. Values set on the index
+    are kept in memory for the current run only.
+
+    The index may be used from several threads.
+    """
+
+    def __init__(self, key, fill, max_age=0, filename=None):
+        """
+        Initialise the index, refreshing it if needed.
+
+        :param key: the name under which the map is stored, e.g. the property
+        :param fill: function returning the full map of value to Q-number
+        :param max_age: number of seconds for which a stored map is used
+        :param filename: the database file. Defaults to identifiers.sqlite
+            in the root of this repo.
+        """
+        self.key = key
+        self.added = {}  # values set during this run
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename or DEFAULT_FILE,
+                                  check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS identifiers '
+                '(key TEXT, value TEXT, qid, PRIMARY KEY (key, value))')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS refreshed '
+                '(key TEXT PRIMARY KEY, retrieved REAL, digest TEXT)')
+            columns = [row[1] for row in self.db.execute(
+                'PRAGMA table_info(refreshed)')]
+            if 'digest' not in columns:  # stored by an earlier version
+                self.db.execute('ALTER TABLE refreshed ADD COLUMN digest TEXT')
+
+        row = self.db.execute(
+            'SELECT retrieved, digest FROM refreshed WHERE key = ?', (key, )
+        ).fetchone()
+        if row is None or time.time() - row[0] >= max_age:
+            self.refresh(fill(), row[1] if row else None)
+
+    def refresh(self, data, digest=None):
+        """
+        Replace the stored map, unless it is unchanged.
+
+        :param data: dict of value to Q-number
+        :param digest: the digest of the stored map, if known
+        """
+        new_digest = IdentifierIndex.make_digest(data)
+        with self.lock, self.db:
+            if new_digest != digest:
+                self.db.execute(
+                    'DELETE FROM identifiers WHERE key = ?', (self.key, ))
+                self.db.executemany(
+                    'INSERT INTO identifiers VALUES (?, ?, ?)',
+                    ((self.key, value, qid) for value, qid in data.items()))
+            self.db.execute(
+                'INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?)',
+                (self.key, time.time(), new_digest))
+
+    @staticmethod
+    def make_digest(data):
+        """
+        Make a digest identifying the contents of a map.
+
+        :param data: dict of value to Q-number
+        :return: str
+        """
+        digest = hashlib.sha1()
+        for value, qid in sorted(data.items()):
+            digest.update(u'{0}\t{1}\n'.format(value, qid).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __getitem__(self, value):
+        """Return the Q-number for an identifier value."""
+        if value in self.added:
+            return self.added[value]
+        with self.lock:
+            row = self.db.execute(
+                'SELECT qid FROM identifiers WHERE key = ? AND value = ?',
+                (self.key, value)).fetchone()
+        if row is None:
+            raise KeyError(value)
+        return row[0]
+
+    def __setitem__(self, value, qid):
+        """Add a Q-number for an identifier value, for this run only."""
+        self.added[value] = qid
+
+    def __contains__(self, value):
+        """Check if there is a Q-number for an identifier value."""
+        try:
+            self[value]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, value, default=None):
+        """Return the Q-number for an identifier value, or the default."""
+        try:
+            return self[value]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return all of the identifier values."""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT value FROM identifiers WHERE key = ?', (self.key, ))
+            values = set(row[0] for row in rows)
+        return list(values.union(self.added))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Bulk loading of Wikidata items."""
+import pywikibot
+
+MAX_ENTITIES = 50  # max number of ids per wbgetentities request
+
+
+def preload_items(repo, qids):
+    """
+    Load the given items using batched requests.
+
+    Missing items and redirects are left out and are instead loaded the
+    usual way, if ever needed.
+
+    :param repo: the data repository
+    :param qids: Q-ids of the items to load
+    :return: dict of Q-id to loaded pywikibot.ItemPage
+    """
+    items = {}
+    qids = sorted(set(qids))
+    for i in range(0, len(qids), MAX_ENTITIES):
+        request = pywikibot.data.api.Request(
+            site=repo,
+            parameters={
+                'action': 'wbgetentities',
+                'ids': '|'.join(qids[i:i + MAX_ENTITIES])})
+        data = request.submit()
+        for qid, entity in data['entities'].items():
+            if 'missing' in entity or 'redirects' in entity:
+                continue
+            # pass the content on, as done by preloaditempages()
+            item = pywikibot.ItemPage(repo, qid)
+            item._content = entity
+            item.get()
+            items[qid] = item
+    return items
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""A local store of query results."""
+import json
+import time
+
+
+def load_query_results(filename, key, query, max_age=0):
+    """
+    Return the results of a query, reusing any stored results.
+
+    Results are stored locally, under the given key, and reused for as long
+    as they are younger than max_age.
+
+    :param filename: the file holding the stored results
+    :param key: the key under which the results are stored, e.g. the query
+    :param query: function running the query and returning json
+        serialisable results
+    :param max_age: number of seconds for which stored results are used
+    :return: the query results
+    """
+    stored = {}
+    try:
+        with open(filename) as f:
+            stored = json.load(f)
+    except (IOError, ValueError):
+        pass
+
+    entry = stored.get(key)
+    if entry and time.time() - entry['retrieved'] < max_age:
+        return entry['data']
+
+    data = query()
+    stored[key] = {'retrieved': time.time(), 'data': data}
+    with open(filename, 'w') as f:
+        json.dump(stored, f)
+    return data
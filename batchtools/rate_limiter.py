@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""A cap on the rate of requests made to an external service."""
+import threading
+import time
+
+
+class RateLimiter(object):
+    """A thread safe cap on the number of requests made per second."""
+
+    def __init__(self, rate=None):
+        """
+        Initialise the limiter.
+
+        :param rate: float|None max number of requests per second. None
+            (or 0) means that no limit is applied.
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request slot is available."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)